@@ -15,14 +15,29 @@ Notes
 
 import subprocess
 import re
+import collections
+import collections.abc
+import contextlib
+import functools
+import glob
+import itertools
 import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import random
 import pprint as pp
 import warnings
 import argparse
+import bisect
+import math
+import sys
 
-import yaml
-from yamllint import linter
-from yamllint.config import YamlLintConfig
+# yaml, yamllint, sqlite3, concurrent.futures and pyarrow are imported
+# where they are used so plain TSV runs don't pay for them at startup
 
 
 # master list of merp measures except pkla which pkla which dumps
@@ -56,36 +71,619 @@ MERP_CATALOG = [
     "slope",
     "pks",
 ]
+MERP_CATALOG_SET = frozenset(MERP_CATALOG)
+
+
+# ------------------------------------------------------------
+# per-stage profiling
+# ------------------------------------------------------------
+
+
+class Profiler:
+    """wall time, CPU time, calls and bytes for each stage of a run
+
+    Stages are timed only while a Profiler is active, use it as a
+    context manager around run_merp(), format_output(), etc.
+
+    ```
+    with Profiler() as prof:
+        format_output(run_merp(mcf), mcf)
+    print(prof.summary())
+    ```
+
+    Stages
+    ------
+    parse_merpfile : read and expand command files, bytes read
+    md5 : hash ERP files, bytes hashed
+    merp : merp subprocesses, bytes of stdout and stderr
+    native : measurements computed in-process with engine="native"
+    parse : parse long form merp output, bytes parsed
+    convert : type conversion of the output rows
+    tags : merge the tag file columns
+    format : TSV or YAML text, bytes formatted
+    write : write and flush the output stream, bytes written
+    arrow : parquet and feather batches, bytes of Arrow data
+    validate : merp -d cross check, bytes of merp -d output. The short
+        merp runs of sample validation are counted under merp as well
+
+    Notes
+    -----
+
+    * CPU time is that of the thread doing the work, wall time is summed
+      over threads, so with jobs > 1 the stages can add up to more
+      than the elapsed time. merp's own CPU time is in the child CPU
+      total.
+
+    """
+
+    def __init__(self):
+        self.stages = collections.OrderedDict()  # name -> [calls, wall, cpu, bytes]
+        self.wall, self.cpu, self.child_cpu = 0.0, 0.0, 0.0
+        self._lock = threading.Lock()
+        self._start = None
+
+    def __enter__(self):
+        global _PROFILER
+        _PROFILER = self
+        times = os.times()
+        self._start = (
+            time.perf_counter(),
+            time.process_time(),
+            times.children_user + times.children_system,
+        )
+        return self
+
+    def __exit__(self, *exc):
+        global _PROFILER
+        _PROFILER = None
+        times = os.times()
+        self.wall += time.perf_counter() - self._start[0]
+        self.cpu += time.process_time() - self._start[1]
+        self.child_cpu += times.children_user + times.children_system - self._start[2]
+        return False
+
+    def add(self, stage, wall, cpu, nbytes=0, calls=1):
+        """accumulate one or more calls of a stage"""
+        with self._lock:
+            totals = self.stages.setdefault(stage, [0, 0.0, 0.0, 0])
+            totals[0] += calls
+            totals[1] += wall
+            totals[2] += cpu
+            totals[3] += nbytes
+
+    def report(self):
+        """the profile as a JSON-ready dict"""
+        return {
+            "wall_s": self.wall,
+            "cpu_s": self.cpu,
+            "child_cpu_s": self.child_cpu,
+            "stages": collections.OrderedDict(
+                (stage, dict(calls=calls, wall_s=wall, cpu_s=cpu, bytes=nbytes))
+                for stage, (calls, wall, cpu, nbytes) in self.stages.items()
+            ),
+        }
+
+    def summary(self):
+        """the profile as a text table"""
+        lines = [
+            "{0:<16}{1:>10}{2:>12}{3:>12}{4:>14}".format(
+                "stage", "calls", "wall_s", "cpu_s", "bytes"
+            )
+        ]
+        for stage, (calls, wall, cpu, nbytes) in self.stages.items():
+            lines.append(
+                "{0:<16}{1:>10}{2:>12.3f}{3:>12.3f}{4:>14}".format(
+                    stage, calls, wall, cpu, nbytes
+                )
+            )
+        lines.append(
+            "total wall {0:.3f} s, cpu {1:.3f} s, "
+            "merp and other child cpu {2:.3f} s".format(
+                self.wall, self.cpu, self.child_cpu
+            )
+        )
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=1)
+
+
+_PROFILER = None  # the active Profiler, if any
+
+
+def _tic():
+    """start timing a stage, None if nobody is profiling"""
+    if _PROFILER is None:
+        return None
+    return (time.perf_counter(), time.thread_time())
+
+
+def _toc(stage, tic, nbytes=0):
+    """stop timing a stage started with _tic()"""
+    if tic is not None and _PROFILER is not None:
+        wall, cpu = time.perf_counter() - tic[0], time.thread_time() - tic[1]
+        _PROFILER.add(stage, wall, cpu, nbytes)
 
 
 # ------------------------------------------------------------
 # helpers for the supplementary column data in the YAML file
 # ------------------------------------------------------------
 
-TAGF_LINT_CONFIG = YamlLintConfig("extends: default")
+# md5 digests of tag file text that passed yamllint in this process
+_LINTED_TAGS = set()
+
 
+@functools.lru_cache(maxsize=None)
+def _tagf_lint_config():
+    """yamllint config for tag files, built on first use"""
+    from yamllint.config import YamlLintConfig
 
-def lint_tags(tag_stream):
-    """ run yamllint on tag file stream, die informatively on errors """
-    errors = [e for e in linter.run(tag_stream, TAGF_LINT_CONFIG)]
+    return YamlLintConfig("extends: default")
+
+
+def __getattr__(name):
+    """TAGF_LINT_CONFIG is built when first looked up, not at import"""
+    if name == "TAGF_LINT_CONFIG":
+        return _tagf_lint_config()
+    raise AttributeError("module {0} has no attribute {1}".format(__name__, name))
+
+
+def _lint_marker(cache, digest):
+    """empty file in the cache directory marks a tag file digest that passed yamllint"""
+    import yamllint
+
+    marker = "{0}_yamllint-{1}".format(digest, yamllint.APP_VERSION)
+    return os.path.join(cache, "lint", marker)
+
+
+def lint_tags(tag_stream, cache=None):
+    """run yamllint on tag file stream, die informatively on errors
+
+    Tag file text that already passed is not linted again in this
+    process or, with a cache directory, e.g., the -cache one, in later
+    runs with the same yamllint. Nothing is written to disk without one.
+    """
+    digest = hashlib.md5(tag_stream.encode("utf-8")).hexdigest()
+    if digest in _LINTED_TAGS or (
+        cache is not None and os.path.exists(_lint_marker(cache, digest))
+    ):
+        _LINTED_TAGS.add(digest)
+        return
+
+    from yamllint import linter
+
+    errors = [e for e in linter.run(tag_stream, _tagf_lint_config())]
     if errors != []:
         msg = "\n\n*** YAML ERRORS ***\n\n"
         for e in errors:
             msg += "{0}\n".format(e)
         raise Exception(msg)
 
+    _LINTED_TAGS.add(digest)
+    if cache is not None:
+        marker = _lint_marker(cache, digest)
+        try:
+            os.makedirs(os.path.dirname(marker), exist_ok=True)
+            open(marker, "w").close()
+        except OSError:
+            pass  # e.g., read-only cache, lint again next time
+
+
+def load_tagfile(tag_file, lint=True, cache=None):
+    """load tag file, lint=False skips yamllint, cache is passed to lint_tags()"""
+    import yaml
 
-def load_tagfile(tag_file):
-    """ load tag file """
     with open(tag_file, "r") as f:
         tag_stream = f.read()
-    lint_tags(tag_stream)  # raises exception on bad YAML
+    if lint:
+        lint_tags(tag_stream, cache)  # raises exception on bad YAML
     return yaml.load(tag_stream, Loader=yaml.SafeLoader)
 
 
+# ------------------------------------------------------------
+# ERP file digests
+# ------------------------------------------------------------
+
+MD5_CHUNK_SIZE = 2**20  # bytes read per hash update
+
+# (realpath, size, mtime_ns, inode) -> md5 hexdigest, process lifetime
+_MD5_CACHE = dict()
+_MD5_CACHE_LOCK = threading.Lock()
+
+
+def _md5_key(erpfile):
+    """cache key changes if the file is replaced, resized or touched"""
+    st = os.stat(erpfile)
+    return (os.path.realpath(erpfile), st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def erp_md5(erpfile):
+    """md5 hexdigest of erpfile, hashed once per process per file version
+
+    Parameters
+    ----------
+    erpfile : str
+        path to the ERP file merp measured
+
+    Returns
+    -------
+    md5 : str
+        hexdigest of the file contents
+
+    Notes
+    -----
+
+    * the file is streamed through the hash MD5_CHUNK_SIZE bytes at a
+      time rather than read into memory whole.
+
+    * digests are cached on (realpath, size, mtime_ns, inode) so the
+      same .avg or .nrm file measured at many channels and measures
+      is hashed once.
+
+    """
+    key = _md5_key(erpfile)
+    with _MD5_CACHE_LOCK:
+        md5 = _MD5_CACHE.get(key)
+    if md5 is not None:
+        return md5
+
+    # hash unlocked, two threads may both hash a new file but don't wait on each other
+    tic = _tic()
+    m = hashlib.md5()
+    with open(erpfile, "rb") as f:
+        for chunk in iter(lambda: f.read(MD5_CHUNK_SIZE), b""):
+            m.update(chunk)
+    _toc("md5", tic, key[1])
+    with _MD5_CACHE_LOCK:
+        return _MD5_CACHE.setdefault(key, m.hexdigest())
+
+
+def load_md5_store(md5_store):
+    """seed the digest cache from a JSON sidecar file written by save_md5_store
+
+    Entries for files that have since changed are loaded but never
+    match, a missing md5_store is silently skipped.
+    """
+    if not os.path.exists(md5_store):
+        return
+    with open(md5_store, "r") as f:
+        store = json.load(f)
+    with _MD5_CACHE_LOCK:
+        for path, (size, mtime_ns, ino, md5) in store.items():
+            _MD5_CACHE[(path, size, mtime_ns, ino)] = md5
+
+
+def save_md5_store(md5_store):
+    """write the current digests to a JSON sidecar file for the next run"""
+    with _MD5_CACHE_LOCK:
+        store = dict(
+            (path, [size, mtime_ns, ino, md5])
+            for (path, size, mtime_ns, ino), md5 in _MD5_CACHE.items()
+        )
+    tmp = "{0}.{1}.tmp".format(md5_store, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(store, f, indent=1, sort_keys=True)
+    os.replace(tmp, md5_store)  # atomic, readers never see a partial file
+
+
+# ------------------------------------------------------------
+# measurement result cache
+# ------------------------------------------------------------
+
+CACHE_MAX_BYTES = 2**30  # evict least recently used rows past 1 GB
+CACHE_MAX_AGE = 90 * 24 * 3600  # evict rows unused for 90 days, in seconds
+CACHE_TIMEOUT = 60  # seconds to wait for another run's write to the cache
+
+# keys run_merp adds to the parsed merp output, not cached
+_LOGGED_KEYS = ("erp_md5_s", "baseline_s", "merpfile_s")
+
+
+def default_cache_dir():
+    """per-user cache directory, $XDG_CACHE_HOME/merp2tbl or ~/.cache/merp2tbl"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "merp2tbl")
+
+
+def merp_version():
+    """md5 of the merp executable on $PATH, 'NA' if there isn't one"""
+    merp_exe = shutil.which("merp")
+    if merp_exe is None:
+        return "NA"
+    return erp_md5(merp_exe)
+
+
+class ResultCache:
+    """on-disk SQLite cache of parsed merp measurements
+
+    Rows are parse_long_merp_output() dicts keyed on (erp_md5,
+    baseline, measure, merp_version) so a changed ERP file, baseline,
+    measure command or merp binary is a miss.
+
+    The database is in WAL mode and every write is a short
+    transaction, puts are committed by commit() after each unit of a
+    run and the access times of hits are written in a batch then, so
+    runs in other processes sharing the cache aren't locked out.
+
+    Parameters
+    ----------
+    cache_dir : str (None)
+        directory for the results.sqlite database, default_cache_dir() if None
+    max_bytes : int
+        evict least recently used rows when the stored rows exceed this size
+    max_age : float
+        evict rows not used in this many seconds
+
+    """
+
+    def __init__(
+        self, cache_dir=None, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE
+    ):
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "results.sqlite")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits, self.misses = 0, 0
+
+        import sqlite3
+
+        self._accessed = dict()  # key -> time of hits not yet written
+        self._db = sqlite3.connect(self.path, timeout=CACHE_TIMEOUT)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " erp_md5 TEXT, baseline TEXT, measure TEXT, merp_version TEXT,"
+                " row TEXT, accessed REAL,"
+                " PRIMARY KEY (erp_md5, baseline, measure, merp_version))"
+            )
+
+    @staticmethod
+    def key(merp_cmds, version):
+        """cache key for a (file, baseline, measure) command 3-ple"""
+        erp_md5_s = erp_md5(merp_cmds[0].split(" ", 1)[1])
+        return (erp_md5_s, merp_cmds[1], " ".join(merp_cmds[2].split()), version)
+
+    def contains(self, key):
+        """True if key is cached, does not count as a hit but counts as a use
+
+        The row may still be evicted by another run before get(), see
+        _iter_merp()
+        """
+        found = self._db.execute(
+            "SELECT 1 FROM results WHERE erp_md5=? AND baseline=? AND measure=?"
+            " AND merp_version=?",
+            key,
+        ).fetchone()
+        if found is None:
+            return False
+        self._accessed[tuple(key)] = time.time()
+        return True
+
+    def get(self, key):
+        """cached measurement MerpRecord or None"""
+        found = self._db.execute(
+            "SELECT row FROM results WHERE erp_md5=? AND baseline=? AND measure=?"
+            " AND merp_version=?",
+            key,
+        ).fetchone()
+        if found is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._accessed[tuple(key)] = time.time()
+        return _categorical_record(json.loads(found[0]))
+
+    def put(self, key, measurement):
+        """cache a measurement, minus the keys run_merp logs, written on commit()"""
+        row = dict((k, v) for k, v in measurement.items() if k not in _LOGGED_KEYS)
+        self._db.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+            tuple(key) + (json.dumps(row), time.time()),
+        )
+
+    def commit(self):
+        """write pending puts and the access times of hits, one short transaction"""
+        if self._accessed:
+            self._db.executemany(
+                "UPDATE results SET accessed=? WHERE erp_md5=? AND baseline=?"
+                " AND measure=? AND merp_version=?",
+                [(accessed,) + key for key, accessed in self._accessed.items()],
+            )
+            self._accessed.clear()
+        self._db.commit()
+
+    def evict(self):
+        """drop stale rows, then least recently used rows until under max_bytes"""
+        self.commit()  # access times of the hits so far
+        with self._db:
+            self._db.execute(
+                "DELETE FROM results WHERE accessed < ?", (time.time() - self.max_age,)
+            )
+            total = self._db.execute(
+                "SELECT COALESCE(SUM(LENGTH(row)), 0) FROM results"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                stale = self._db.execute(
+                    "SELECT rowid, LENGTH(row) FROM results ORDER BY accessed"
+                )
+                drop = []
+                for rowid, nbytes in stale:
+                    if total <= self.max_bytes:
+                        break
+                    drop.append((rowid,))
+                    total -= nbytes
+                self._db.executemany("DELETE FROM results WHERE rowid=?", drop)
+
+    def close(self):
+        self.commit()
+        self.evict()
+        self._db.close()
+
+
+class RunManifest:
+    """rows of the previous run by expanded command, for incremental reruns
+
+    A JSON file of the measurements from the last run keyed on the
+    expanded (file, baseline, measure) command, the ERP file md5 and
+    the merp version. Used in place of a ResultCache, commands with an
+    unchanged key are read back, the rest are run through merp, and
+    the manifest is rewritten with the rows of this run on close(),
+    so it always mirrors the latest output table.
+
+    Parameters
+    ----------
+    path : str
+        manifest file, read if it exists, written on close()
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits, self.misses = 0, 0
+        self._prior, self._rows = dict(), dict()
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for key, row in json.load(f)["rows"]:
+                    self._prior[tuple(key)] = row
+
+    @staticmethod
+    def key(merp_cmds, version):
+        """manifest key for a (file, baseline, measure) command 3-ple"""
+        erp_md5_s = erp_md5(merp_cmds[0].split(" ", 1)[1])
+        measure = " ".join(merp_cmds[2].split())
+        return (merp_cmds[0], merp_cmds[1], measure, erp_md5_s, version)
+
+    def contains(self, key):
+        """True if the previous run has the row, does not count as a hit"""
+        return key in self._prior
+
+    def get(self, key):
+        """previous measurement MerpRecord or None"""
+        if key not in self._prior:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._rows[key] = self._prior[key]
+        return _categorical_record(self._prior[key])
+
+    def put(self, key, measurement):
+        """keep a new measurement, minus the keys run_merp logs per run"""
+        self.misses += 1
+        row = dict((k, v) for k, v in measurement.items() if k not in _LOGGED_KEYS)
+        self._rows[key] = row
+
+    def commit(self):
+        """nothing to do, the manifest is written once the run is done"""
+
+    def close(self):
+        """replace the manifest with the rows of this run"""
+        manifest = {"rows": [[list(key), row] for key, row in self._rows.items()]}
+        tmp = "{0}.{1}.tmp".format(self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, self.path)  # atomic, a failed run leaves the old one
+
+
 # ------------------------------------------------------------
 # merp processing
 # ------------------------------------------------------------
+# command file lines, compiled once
+_COMMENT_LINE_PATT = re.compile(r"^\s*#")
+_TRAILING_COMMENT_PATT = re.compile(r"\s+#.+$")
+_MEAS_PATT = re.compile(
+    r"^(?P<measure>\S+) (?P<bin>\d+) (?P<chan>\S+) (?P<file>\S+) (?P<args>.*)$"
+)
+
+
+class MerpCommands(collections.abc.Sequence):
+    """the expanded (file, baseline, measure) command 3-ples of a command file
+
+    Each measure line is stored once with the channel and file lists
+    it expands over, the 3-ples are built when iterated or indexed
+    so a measure over many channels and files isn't materialized.
+    len() is the number of 3-ples without expanding them.
+
+    Parameters
+    ----------
+    files : list of str
+       the command file's file list, appended to as it is parsed,
+       each measure line records how many files it sees
+    """
+
+    def __init__(self, files):
+        self._files = files
+        self._lines = []  # (file_cmd, n_files, channels, baseline, cmd_str)
+        self._starts = []  # index of each line's first 3-ple
+        self._len = 0
+
+    def append(self, file_cmd, n_files, channels, baseline, cmd_str):
+        """add a measure line
+
+        file_cmd is None for *, n_files for file *, channels for chan $
+        """
+        self._lines.append((file_cmd, n_files, channels, baseline, cmd_str))
+        self._starts.append(self._len)
+        self._len += (1 if n_files is None else n_files) * (
+            1 if channels is None else len(channels)
+        )
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        files = self._files
+        for file_cmd, n_files, channels, baseline, cmd_str in self._lines:
+            if channels is None:
+                if n_files is None:
+                    yield (file_cmd, baseline, cmd_str)
+                else:
+                    for f in files[:n_files]:
+                        yield ("file " + f, baseline, cmd_str.replace("*", f))
+            else:
+                for c in channels:
+                    if n_files is None:
+                        yield (file_cmd, baseline, cmd_str.replace("$", str(c)))
+                    else:
+                        for f in files[:n_files]:
+                            yield (
+                                "file " + f,
+                                baseline,
+                                cmd_str.replace("*", f).replace("$", str(c)),
+                            )
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self._len))]
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError("merp command index out of range")
+        line = bisect.bisect_right(self._starts, idx) - 1
+        file_cmd, n_files, channels, baseline, cmd_str = self._lines[line]
+        chan_idx, file_idx = divmod(idx - self._starts[line], n_files or 1)
+        if n_files is not None:
+            f = self._files[file_idx]
+            file_cmd, cmd_str = "file " + f, cmd_str.replace("*", f)
+        if channels is not None:
+            cmd_str = cmd_str.replace("$", str(channels[chan_idx]))
+        return (file_cmd, baseline, cmd_str)
+
+    def __eq__(self, other):
+        if isinstance(other, collections.abc.Sequence) and not isinstance(other, str):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "MerpCommands({0})".format(pp.pformat(list(self)))
+
+
 def parse_merpfile(merpfile):
     """parse merp command file
 
@@ -106,6 +704,19 @@ def parse_merpfile(merpfile):
     merpfile : str
         name of a merp file
 
+    Returns
+    -------
+    merp_cmds : MerpCommands
+        sequence of (file, baseline, measure) command 3-ples in merp
+        order, expanded as they are used
+
+    Raises
+    ------
+    NotImplementedError
+        for commands merp2tbl doesn't handle
+    ValueError
+        for malformed file, channels, and measure lines
+
     Notes
     ------
 
@@ -182,124 +793,213 @@ def parse_merpfile(merpfile):
 
     """
 
+    tic = _tic()
     with open(merpfile, "r") as f:
-        merp_cmds = f.read()
-    merp_cmds = re.sub(r"\n+", "\n", merp_cmds)
-    merp_cmds = merp_cmds.split("\n")
-
-    # cleanup whitespace
-    merp_cmds = [
-        re.sub(r"\s+", " ", m)
-        for m in merp_cmds
-        if re.match(r"(^$)|(^\s*#)", m) is None
+        merp_text = f.read()
+
+    files = []  # for wildcard expansion, accumulate all files
+    merp_cmds = MerpCommands(files)
+    channels = ()  # for wildcard expansion, set/reset when encountered
+    baseline = (
+        "default"  # if not overwritten, merp2tbl falls back to merp prestim default
+    )
+
+    for line in merp_text.split("\n"):
+        # drop comments, collapse whitespace
+        if "#" in line:
+            if _COMMENT_LINE_PATT.match(line):
+                continue
+            line = _TRAILING_COMMENT_PATT.sub("", line)
+        cmd_spec = line.split()
+        if not cmd_spec:
+            continue
+        cmd = cmd_spec[0]  # first field of merp command
+        cmd_str = " ".join(cmd_spec)
+
+        if cmd in MERP_CATALOG_SET:
+            meas_match = _MEAS_PATT.match(cmd_str)
+            if meas_match is None:
+                msg = "merpfile: {0} line: {1}\n".format(merpfile, cmd_str)
+                msg += "expected: measure bin chan file args ..."
+                raise ValueError(msg)
+            chan, erpfile = meas_match.group("chan", "file")
+            merp_cmds.append(
+                None if erpfile == "*" else "file " + erpfile,
+                len(files) if erpfile == "*" else None,
+                channels if chan == "$" else None,
+                baseline,
+                cmd_str,
+            )
+        elif cmd == "file":
+            if len(cmd_spec) < 2:
+                msg = "merpfile: {0} line: {1}\n".format(merpfile, cmd_str)
+                raise ValueError(msg + "file name missing")
+            files.append(cmd_spec[1])
+        elif cmd == "channels":
+            # always set channels
+            try:
+                channels = tuple(int(c) for c in cmd_spec[1:])
+            except ValueError:
+                channels = None
+            if channels is None or not all(0 <= c <= 64 for c in channels):
+                msg = "merpfile: {0} line: {1}\n".format(merpfile, cmd_str)
+                raise ValueError(msg + "channels must be integers 0 - 64")
+        elif cmd in TRANSFORMS:
+            baseline = cmd_str
+        else:
+            implemented_cmds = ["file", "channels"] + TRANSFORMS + MERP_CATALOG
+            msg = "merpfile: {0} line: {1}\n".format(merpfile, cmd_str)
+            msg += pp.pformat("choose from: " + " ".join(implemented_cmds))
+            raise NotImplementedError(msg)
+
+    _toc("parse_merpfile", tic, len(merp_text))
+    return merp_cmds
+
+
+def _merp_cmd_str(merp_cmds):
+    """build the merp command file lines for a file, baseline, measure(s) 3-ple
+
+    The baseline is omitted if 'default' so merp falls back to its
+    prestimulus default. The measure item may be a single measure
+    string or a list of them for a batched run.
+    """
+    file_cmd, baseline, measures = merp_cmds
+    if isinstance(measures, str):
+        measures = [measures]
+    cmds = [file_cmd] + ([] if baseline == "default" else [baseline]) + measures
+    return "\n".join(cmds) + "\n"
+
+
+def _merp_stdin(cmd_str, short=False):
+    """run merp - (merp -d - if short) with cmd_str on stdin, return stdout, stderr"""
+    tic = _tic()
+    merp_proc = subprocess.Popen(
+        ["merp", "-d", "-"] if short else ["merp", "-"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    stdout, stderr = merp_proc.communicate(cmd_str.encode("utf-8"))
+    _toc("merp", tic, len(stdout) + len(stderr))
+    return stdout, stderr
+
+
+def _split_long_merp_output(data_bytes):
+    """split long form merp output for several measures into one chunk per measure
+
+    Each measurement starts on a line beginning with Channel, see
+    parse_long_merp_output()
+    """
+    return [
+        chunk + b"\n"
+        for chunk in re.split(rb"\n(?=Channel)", data_bytes.strip())
+        if chunk.strip() != b""
     ]
 
-    # cleanup trailing comments
-    merp_cmds = [re.sub(r"\s+#.+$", "", m).strip() for m in merp_cmds]
 
-    # whitelist commands we can handle
-    implemented_cmds = ["file", "channels"] + TRANSFORMS + MERP_CATALOG
+def _group_merp_cmds(indexed_cmds):
+    """group (index, command 3-ple) by (file, baseline) in order of first appearance
 
-    # merp_cmds is a list of cmd_docs, each doc is a dict of
-    # file, baseline, channel, measure key:values
+    Returns
+    -------
+    groups : list of 2-ples
+        (list of canonical indexes, list of 3-ples)
+    """
+    groups = dict()
+    for idx, merp_cmds in indexed_cmds:
+        group = groups.setdefault(merp_cmds[:2], ([], []))
+        group[0].append(idx)
+        group[1].append(merp_cmds)
+    return list(groups.values())
 
-    cmd_list = []
 
-    from_state = 0  # initial state
+def _measure(merp_cmds, mcf):
+    """run merp on one command 3-ple, return the parsed measurement dict"""
 
-    # list of minimal merp command 3-ples
-    # (fileame,
-    #  baseline_spec=(None, "baseline start stop", "nobaseline", measure_spec),
-    # measure literal chan, file)
+    cmd_str = _merp_cmd_str(merp_cmds)
+    stdout, stderr = _merp_stdin(cmd_str)
+    return _measure_output(stdout, stderr, cmd_str, merp_cmds, mcf)
 
-    cmd_list = []  #
-    files = []  # for wildcard expansion, accumulate all files
-    channels = []  # for wildcard expansion, set/reset when encountered
-    baseline = (
-        "default"  # if not overwritten, merp2tbl falls back to merp prestim default
-    )
 
-    for cmd_str in merp_cmds:
-        if from_state == 6:
-            # something bad happened
-            raise ValueError("uh oh ... ", cmd_str)
+def _measure_output(stdout, stderr, cmd_str, merp_cmds, mcf):
+    """parse the merp output of one command 3-ple, see _measure()"""
 
-        # split the command and process ...
-        cmd_spec = cmd_str.split(" ")
-        if cmd_spec[0] not in implemented_cmds:
-            msg = "merpfile: {0} line: {1}\n".format(merpfile, cmd_str)
-            msg += pp.pformat("choose from: " + " ".join(implemented_cmds))
-            raise NotImplementedError(msg)
+    # catch merp hard errors with no data
+    if re.match("^$", stdout.decode("utf-8")):
+        msg = "No merp output: {0}".format(stderr.decode("utf-8"))
+        msg += "merpfile: {0}: ".format(mcf)
+        msg += pp.pformat(cmd_str)
+        raise RuntimeError(msg)
 
-        cmd = cmd_spec[0]  # first field of merp command
+    measurement = LONG_MERP_PARSER.parse(stdout, stderr)
+    return _log_measurement(measurement, merp_cmds, mcf)
 
-        # handle file
-        if cmd == "file":
-            # state_key = 'file'
-            files.append(cmd_spec[1])
 
-        # always set channels
-        if cmd == "channels":
-            # state_key = 'channels'
-            channels = [int(c) for c in cmd_spec[1:]]
-            assert all([c >= 0 and c <= 64] for c in channels)
+def _measure_batch(merp_cmds_group, mcf):
+    """run merp once on a list of command 3-ples with the same file and baseline
 
-        # handle baselines
-        if cmd in ["baseline", "nobaseline"]:
-            # state_key = 'baseline'
-            baseline = cmd_str
+    merp stderr can't be attributed to a particular measure in a
+    batch, so if merp complains at all or the output doesn't split
+    into one chunk per measure the group is rerun one measure at a
+    time, the same as the unbatched run.
+    """
+    if len(merp_cmds_group) > 1:
+        stdout, stderr = _merp_stdin(_batch_cmd_str(merp_cmds_group))
+        measurements = _batch_output(stdout, stderr, merp_cmds_group, mcf)
+        if measurements is not None:
+            return measurements
+    return [_measure(merp_cmds, mcf) for merp_cmds in merp_cmds_group]
+
+
+def _batch_cmd_str(merp_cmds_group):
+    """merp command file lines for a group of 3-ples with the same file and baseline"""
+    file_cmd, baseline = merp_cmds_group[0][:2]
+    return _merp_cmd_str((file_cmd, baseline, [cmds[2] for cmds in merp_cmds_group]))
+
+
+def _batch_output(stdout, stderr, merp_cmds_group, mcf):
+    """parse the merp output of a batch, None if it must be rerun a measure at a time"""
+    chunks = _split_long_merp_output(stdout)
+    if stderr != b"" or len(chunks) != len(merp_cmds_group):
+        return None
+    rows = LONG_MERP_PARSER.parse_many((chunk, b"") for chunk in chunks)
+    return [
+        _log_measurement(row, merp_cmds, mcf)
+        for row, merp_cmds in zip(rows, merp_cmds_group)
+    ]
 
-        # parse measurement string
-        if cmd in MERP_CATALOG:
-            meas_patt = (
-                r"^\s*"
-                r"(?P<measure>\S+)\s+"
-                r"(?P<bin>\d+)\s+"
-                r"(?P<chan>\S+)\s+"
-                r"(?P<file>\S+)\s+"
-                r"(?P<args>.*)\s*$"
-            )
 
-            meas_match = re.match(meas_patt, cmd_str)
-            assert meas_match is not None
-            meas_cmd = meas_match.groupdict()
+def _log_measurement(measurement, merp_cmds, mcf):
+    """add the ERP file md5, baseline, and merp command file to a measurement"""
 
-            # four cases +/- chan wildcard, +/- file wildcard
-            if meas_cmd["chan"] == "$":
-                for c in channels:
-                    if meas_cmd["file"] == "*":
-                        for f in files:
-                            # build and append the 3-ple
-                            cmd_list.append(
-                                (
-                                    "file " + f,
-                                    baseline,
-                                    re.sub(r"\$", str(c), re.sub(r"\*", f, cmd_str),),
-                                )
-                            )
-                    else:
-                        cmd_list.append(
-                            # build and append the 3-ple
-                            (
-                                "file " + meas_cmd["file"],
-                                baseline,
-                                re.sub(r"\$", str(c), cmd_str),
-                            )
-                        )
-            else:
-                if meas_cmd["file"] == "*":
-                    for f in files:
-                        # build and append the 3-ple
-                        cmd_list.append(
-                            ("file " + f, baseline, re.sub(r"\*", f, cmd_str))
-                        )
-                else:
-                    # build and append the 3-ple
-                    cmd_list.append(("file " + meas_cmd["file"], baseline, cmd_str))
-    return cmd_list
+    # snapshot MD5 of file measured ...
+    measurement.update({"erp_md5_s": erp_md5(measurement["erpfile_s"])})
+
+    # log baseline
+    if merp_cmds[1] == "default":
+        measurement.update({"baseline_s": "default"})
+    else:
+        measurement.update({"baseline_s": sys.intern(merp_cmds[1])})
+
+    # log file
+    measurement.update({"merpfile_s": sys.intern(mcf)})
+    return measurement
 
 
-def run_merp(mcf, debug=False):
+def _categorical_record(row):
+    """MerpRecord from a stored measurement dict, repeated metadata interned"""
+    return MerpRecord(
+        row.keys(),
+        [
+            sys.intern(v) if k in CATEGORICAL_KEYS and type(v) is str else v
+            for k, v in row.items()
+        ],
+    )
+
+
+def run_merp(
+    mcf, debug=False, batch=False, jobs=1, md5_store=None, cache=None, engine="merp"
+):
     """wrapper parses command file mcf, runs the measurements one test at a time via  merp - stdin
 
     Parameters
@@ -308,6 +1008,23 @@ def run_merp(mcf, debug=False):
         path to merp command file
     debug : bool
         if true reports internal command dict before running merp
+    batch : bool
+        if true run all the measures on the same file and baseline
+        through one merp process instead of one process per measure
+    jobs : int
+        number of merp processes to run at the same time
+    md5_store : str (None)
+        path to a JSON file of ERP file digests, read before and
+        updated after the run so unchanged files aren't hashed again
+    cache : str, ResultCache or RunManifest (None)
+        directory of the on-disk measurement cache, an open
+        ResultCache, or the RunManifest of the previous run to only
+        rerun changed commands. None to always run merp
+    engine : str ('merp'), 'native', 'native-all'
+        'native' computes the NATIVE_CALIBRATED measures in-process from
+        the ERP files, see measure_native(), and runs merp for the
+        rest. 'native-all' computes all the NATIVE_MEASURES, including
+        the ones not checked against merp output
 
     Returns
     -------
@@ -321,6 +1038,32 @@ def run_merp(mcf, debug=False):
       individual measures and run through merp one at a time to capture
       stdout and stderr output for the specific test.
 
+    * in batch mode the expanded measures are grouped by file and
+      baseline, each group is run through one merp process and the
+      long form output split back into measures. Groups with merp
+      errors are rerun one measure at a time so stderr diagnostics
+      land on the right measure. Either way the measurements are
+      returned in canonical merp order.
+
+    * with jobs > 1 the measures (or batches) are dispatched to a pool
+      of worker threads, each waiting on its own merp process. Results
+      are collected in canonical merp order regardless of which merp
+      finishes first so rows line up with positional -tagf tags.
+
+    * identical expanded measures, e.g., a measure written out and
+      again in a $ or * expansion, or a file listed twice, are run
+      once and the measurement copied to each row, within a window of
+      the last DEDUP_WINDOW distinct commands. -debug reports the dedup
+      ratio, measures / unique measures, on stderr.
+
+    * with a cache, measures already run on an identical ERP file with
+      the same baseline, measure command and merp binary are read from
+      the cache and not run through merp at all.
+
+    * with a RunManifest, likewise for the commands of the previous
+      run, and the new and reused rows are spliced together in
+      canonical order, like make for the command file expansion.
+
     * in the results dicts from the merp output all the values are
       strings and all the keys end in an underscore and printf-like
       data type specification character indicating the natural data
@@ -332,364 +1075,2298 @@ def run_merp(mcf, debug=False):
 
     """
 
-    measurements = []  # results
+    return list(iter_merp(mcf, debug, batch, jobs, md5_store, cache, engine=engine))
+
+
+def iter_merp(
+    mcf,
+    debug=False,
+    batch=False,
+    jobs=1,
+    md5_store=None,
+    cache=None,
+    pool=None,
+    engine="merp",
+):
+    """generate run_merp() measurements one at a time, in canonical merp order
+
+    Parameters are the same as run_merp() plus
+
+    pool : concurrent.futures.Executor (None)
+        run the merp processes on this pool instead of starting one for
+        jobs > 1, e.g., to share it across command files. The caller
+        shuts it down.
 
+    Yields
+    ------
+    measurement : dict
+        parsed long form merp output of one measurement, as soon as it
+        and all the measurements before it are done.
+
+    Notes
+    -----
+
+    * at most a few measures per job are in flight at a time and each
+      measurement is handed off when it is done, so memory does not
+      grow with the size of the command file. Batches span the whole
+      command file so in batch mode measurements wait for the rest of
+      their batch.
+
+    """
     # fetch the merp command file
     merp_cmds_list = parse_merpfile(mcf)
+    for measurement in _iter_merp_records(
+        mcf, merp_cmds_list, debug, batch, jobs, md5_store, cache, pool, engine
+    ):
+        yield dict(measurement)
+
+
+def _iter_merp_records(
+    mcf, merp_cmds_list, debug, batch, jobs, md5_store, cache, pool, engine
+):
+    """iter_merp() of the parsed command file as MerpRecords, for the writers"""
 
     # optionally report
     if debug:
-        print("merpfile ", mcf)
-        pp.pprint(merp_cmds_list)
-
-    for merp_cmds in merp_cmds_list:
-        cmd_str = None
-
-        # build the single measure file lines, except baseline if 'default'
-        cmd_str = "\n".join([cmd for cmd in merp_cmds if cmd is not "default"])
-        cmd_str += "\n"
-
-        # run it
-        file_proc = subprocess.Popen(["echo", cmd_str], stdout=subprocess.PIPE)
-        merp_proc = subprocess.Popen(
-            ["merp", "-"],
-            stdin=file_proc.stdout,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+        _print_merp_cmds(mcf, merp_cmds_list)
+
+    with _run_context(jobs, md5_store, cache, pool) as (pool, result_cache):
+        yield from _iter_merp(
+            merp_cmds_list, mcf, batch, jobs, pool, result_cache, engine, debug
         )
-        stdout, stderr = merp_proc.communicate()
 
-        # catch merp hard errors with no data
-        if re.match("^$", stdout.decode("utf-8")):
-            msg = "No merp output: {0}".format(stderr.decode("utf-8"))
-            msg += "merpfile: {0}: ".format(mcf)
-            msg += pp.pformat(cmd_str)
-            raise RuntimeError(msg)
 
-        # parse the output
-        measurement = parse_long_merp_output(stdout, stderr)
+def _print_merp_cmds(mcf, merp_cmds_list):
+    """debug report of the parsed command file, on stderr, stdout is the table"""
+    print("merpfile ", mcf, file=sys.stderr)
+    print(pp.pformat(list(merp_cmds_list)), file=sys.stderr)
 
-        # snapshot MD5 of file measured ...
-        with open(measurement["erpfile_s"], "rb") as f:
-            m = hashlib.md5()
-            m.update(f.read())
-        measurement.update({"erp_md5_s": m.hexdigest()})
 
-        # log baseline
-        if merp_cmds[1] == "default":
-            measurement.update({"baseline_s": "default"})
-        else:
-            measurement.update({"baseline_s": merp_cmds[1]})
+DEDUP_WINDOW = 2**12  # recent distinct commands whose repeats are copied
 
-        # log file
-        measurement.update({"merpfile_s": mcf})
-        measurements.append(measurement)
-    return measurements
 
+class _Repeats:
+    """streaming dedup of the expanded commands of a run
 
-def parse_long_merp_output(data_bytes, err_bytes):
-    """parse long form merp output bytestring into a sensible dict
+    A command identical to one of the last DEDUP_WINDOW distinct
+    commands, e.g., a measure written out and again in a $ or *
+    expansion, or a file listed twice, isn't measured, its row is a
+    copy of the first measurement. Commands are remembered by digest
+    and the measurements handed off are kept only while in the window
+    or a repeat of them is still to come, so memory doesn't grow with
+    the command file. A repeat of an older command is measured again.
 
-    Parameters
+    parse_merpfile() normalizes the whitespace, so repeats are equal
+    3-ples.
+
+    Attributes
     ----------
-    data_bytes : byte string
-       one line of long form output merp sends to stdout
-    err_bytes : byte string
-       one line that merp sends to stderr, '' if all is well
+    dups : dict
+       {index of a repeat: index of the first measurement} not yet handed off
+    n_commands, n_repeats : int
+       commands seen and repeats found so far
+    """
 
-    Returns
-    -------
-    row_dict : dict
-        keys are column labels for the parsed output row, plus
-        the key 'err' for stderr status, 0 = ok, 1 = some error
+    def __init__(self, window):
+        self.window = window
+        self.dups = dict()
+        self.n_commands, self.n_repeats = 0, 0
+        self.next_idx = 0  # hand-off cursor, earlier firsts are kept or gone
+        self._recent = collections.OrderedDict()  # digest -> first index
+        self._last_use = dict()  # first index -> last repeat index
+        self._kept = collections.OrderedDict()  # first index -> handed off copy
+        self._pinned = dict()  # first index -> copy with repeats to hand off
+
+    def iter_unique(self, indexed_cmds):
+        """yield the (index, 3-ple) to measure, record the repeats"""
+        for idx, merp_cmds in indexed_cmds:
+            self.n_commands += 1
+            key = hashlib.md5("\n".join(merp_cmds).encode("utf-8")).digest()
+            first_idx = self._recent.get(key)
+            if first_idx is not None and (
+                first_idx >= self.next_idx
+                or first_idx in self._kept
+                or first_idx in self._pinned
+            ):
+                self.n_repeats += 1
+                self.dups[idx] = first_idx
+                self._last_use[first_idx] = idx
+                if first_idx in self._kept:
+                    self._pinned[first_idx] = self._kept.pop(first_idx)
+                continue
+            self._recent[key] = idx
+            self._recent.move_to_end(key)
+            if len(self._recent) > self.window:
+                self._recent.popitem(last=False)
+            yield idx, merp_cmds
+
+    def take(self, idx):
+        """the measurement of repeat idx, handed off in order"""
+        self.next_idx = idx + 1
+        first_idx = self.dups.pop(idx)
+        measurement = self._pinned[first_idx].copy()
+        if self._last_use[first_idx] == idx:
+            del self._last_use[first_idx]
+            self._unpin(first_idx, self._pinned.pop(first_idx))
+        return measurement
+
+    def keep(self, idx, measurement):
+        """note the measurement at idx, handed off in order, for repeats to come"""
+        self.next_idx = idx + 1
+        if idx in self._last_use:
+            self._pinned[idx] = measurement.copy()
+        else:
+            self._unpin(idx, measurement.copy())
+
+    def _unpin(self, idx, measurement):
+        self._kept[idx] = measurement
+        if len(self._kept) > self.window:
+            self._kept.popitem(last=False)
+
+    def report(self, mcf):
+        """debug report of the dedup ratio, measures / unique measures"""
+        n_unique = self.n_commands - self.n_repeats
+        print(
+            "merpfile {0} measures {1} unique {2} dedup ratio {3:.2f}".format(
+                mcf, self.n_commands, n_unique, self.n_commands / max(n_unique, 1)
+            ),
+            file=sys.stderr,
+        )
 
-    Notes
-    -----
 
-    * named regex capture groups define the row_dict keys
+def _iter_merp(
+    merp_cmds_list, mcf, batch, jobs, pool, result_cache, engine="merp", debug=False
+):
+    """iter_merp() for the parsed command file on an open pool and cache"""
+
+    if engine not in ENGINES:
+        raise ValueError("engine must be one of {0}: {1}".format(ENGINES, engine))
+    measure = _measure_batch
+    if engine != "merp":
+        measures = NATIVE_MEASURES if engine == "native-all" else NATIVE_CALIBRATED
+        if batch:
+            measure = functools.partial(_measure_native_batch, measures=measures)
+        else:
+            measure = _measure_native_unit
+
+    # repeated commands are measured once and copied
+    repeats = _Repeats(DEDUP_WINDOW)
+    todo = repeats.iter_unique(enumerate(merp_cmds_list))
+
+    # look up cache hits as the commands are expanded, leave the rest for merp
+    cache_keys, cache_hits = dict(), set()
+    if result_cache is not None:
+        # native measurements are cached apart from merp's
+        version = merp_version()
+        if engine != "merp":
+            version = engine + " " + version
+        todo = _iter_cache_misses(todo, result_cache, cache_keys, cache_hits, version)
+
+    if batch:
+        units = _group_merp_cmds(todo)
+    elif engine != "merp":
+        units = _iter_native_units(todo, mcf, measures)
+    else:
+        units = (([idx], [merp_cmds]) for idx, merp_cmds in todo)
+
+    # hand off measurements in canonical order as they come in
+    pending, next_idx = dict(), 0
+
+    def ready(idx):
+        return idx in pending or idx in cache_hits or idx in repeats.dups
+
+    def take(idx):
+        if idx in repeats.dups:
+            return repeats.take(idx)
+        if idx in cache_hits:
+            cached = result_cache.get(cache_keys[idx])
+            if cached is None:
+                # evicted by another run since the lookup, measure it after all
+                (measurement,) = measure([merp_cmds_list[idx]], mcf)
+                result_cache.put(cache_keys[idx], measurement)
+            else:
+                measurement = _log_measurement(cached, merp_cmds_list[idx], mcf)
+        else:
+            measurement = pending.pop(idx)
+        repeats.keep(idx, measurement)
+        return measurement
+
+    for idxs, results in _iter_units(units, mcf, jobs, pool, measure):
+        for idx, measurement in zip(idxs, results):
+            pending[idx] = measurement
+            if idx in cache_keys:
+                result_cache.put(cache_keys[idx], measurement)
+        if result_cache is not None:
+            result_cache.commit()  # short transactions, other runs share the cache
+        while ready(next_idx):
+            yield take(next_idx)
+            next_idx += 1
+
+    # trailing cache hits and repeats
+    for idx in range(next_idx, len(merp_cmds_list)):
+        yield take(idx)
+    if debug:
+        repeats.report(mcf)
+
+
+def _iter_cache_misses(indexed_cmds, result_cache, cache_keys, cache_hits, version):
+    """yield (index, 3-ple) not in the result cache, record keys and hits on the way"""
+    for idx, merp_cmds in indexed_cmds:
+        try:
+            cache_keys[idx] = result_cache.key(merp_cmds, version)
+        except OSError:
+            yield idx, merp_cmds  # missing ERP file, let merp report it
+            continue
+        if result_cache.contains(cache_keys[idx]):
+            cache_hits.add(idx)
+        else:
+            yield idx, merp_cmds
 
-    * merp long form output has a bug that farts out an extra 4 char
-      channel label on the first line. The reg exp takes the first four
-      characters of the channel label field, dropping the last 4, if
-      any. So MiPa -> MiPa and MiCeMiPa -> MiCe
 
+@contextlib.contextmanager
+def _run_context(jobs, md5_store, cache, pool=None):
+    """open the digest store, result cache and worker pool, yield (pool, cache)
+
+    A ResultCache, RunManifest or pool passed in belongs to the caller
+    and is left open, the cache is committed. The digest store is saved
+    only if the run finishes.
     """
 
-    # tabs aren't expected but strip in case
-    data = data_bytes.decode("utf-8").strip().replace("\t", " ")
-    err = err_bytes.decode("utf-8")
+    if not (isinstance(jobs, int) and jobs >= 1):
+        raise ValueError("jobs must be a positive integer: {0}".format(jobs))
 
-    # if there is an error, first line is diagnostic
-    err_match = re.match(r"(?P<error>^.*)\n", err)
-    if err_match is not None:
-        # squeeze extra whitespace
-        err = re.sub(r"\s+", " ", err_match.groupdict()["error"])
+    if md5_store is not None:
+        load_md5_store(md5_store)
 
-    # Define one regex pattern per output line for
-    # readibility/debugging
+    result_cache = cache
+    if isinstance(cache, str):
+        result_cache = ResultCache(cache)
 
-    # line 1 work around double label merp bug
-    patt1 = (
-        r"^Channel\s+"
-        r"(?P<chan_desc_s>.{4})(?:.{4})*\s+Sum of\s+"
-        r"(?P<epochs_d>\S+)"
-    )
+    # merp is an external process, threads just wait on it
+    own_pool = None
+    if pool is None and jobs > 1:
+        import concurrent.futures
 
-    # line 2 fixed length fields until the last.
-    patt2 = (
-        r"^.+\n"
-        r"(?P<subject_s>.{41})"
-        r"(?P<bin_desc_s>.{40})"
-        r"(?P<condition_s>.{41})"
-        r"(?P<expt_s>.{40})"
-        r"(?P<meas_specs_s>.*)"
-        r"[\\\\n]*"
-    )
+        pool = own_pool = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
 
-    # line 3 may not exist, e.g., on bad baseline error
-    patt3 = (
+    try:
+        yield pool, result_cache
+    finally:
+        if own_pool is not None:
+            own_pool.shutdown()
+        if result_cache is cache and result_cache is not None:
+            result_cache.commit()  # caller's cache, caller closes
+        elif result_cache is not None:
+            result_cache.close()
+
+    if md5_store is not None:
+        save_md5_store(md5_store)
+
+
+def _iter_units(units, mcf, jobs, pool=None, measure=_measure_batch):
+    """yield (indexes, measurements) for each unit in order, jobs merp runs at a time"""
+
+    if pool is None:
+        for idxs, merp_cmds_group in units:
+            yield idxs, measure(merp_cmds_group, mcf)
+        return
+
+    # A few units per worker are queued so workers don't idle while the
+    # caller handles results, without holding the whole run in memory.
+    in_flight = collections.deque()
+    for idxs, merp_cmds_group in units:
+        in_flight.append((idxs, pool.submit(measure, merp_cmds_group, mcf)))
+        if len(in_flight) >= 2 * jobs:
+            idxs, future = in_flight.popleft()
+            yield idxs, future.result()
+    while in_flight:
+        idxs, future = in_flight.popleft()
+        yield idxs, future.result()
+
+
+# ------------------------------------------------------------
+# many command files
+# ------------------------------------------------------------
+
+
+def expand_merpfiles(mcfs):
+    """expand glob patterns in a list of command file names
+
+    Parameters
+    ----------
+    mcfs : str or list of str
+        merp command file paths or glob patterns, e.g., "s0*/*.mcf"
+
+    Returns
+    -------
+    mcfs : list of str
+        paths in the order given, each pattern's matches sorted. Names
+        without glob characters are kept as is, so a missing file is
+        reported when it is read.
+
+    """
+    if isinstance(mcfs, str):
+        mcfs = [mcfs]
+
+    expanded = []
+    for mcf in mcfs:
+        if glob.has_magic(mcf):
+            matches = sorted(glob.glob(mcf))
+            if matches == []:
+                raise ValueError("no merp command files match {0}".format(mcf))
+            expanded += matches
+        else:
+            expanded.append(mcf)
+    return expanded
+
+
+def run_merp_files(
+    mcfs, debug=False, batch=False, jobs=1, md5_store=None, cache=None, engine="merp"
+):
+    """run_merp() for many command files in one go
+
+    Parameters are the same as run_merp() except
+
+    mcfs : str or list of str
+        merp command file paths or glob patterns, see expand_merpfiles()
+
+    Returns
+    -------
+    measurements : list of dict
+        the measurements of each command file in turn, the command file
+        is in the merpfile_s key.
+
+    """
+    return list(
+        iter_merp_files(mcfs, debug, batch, jobs, md5_store, cache, engine=engine)
+    )
+
+
+def iter_merp_files(
+    mcfs, debug=False, batch=False, jobs=1, md5_store=None, cache=None, engine="merp"
+):
+    """generate run_merp_files() measurements one at a time, file by file
+
+    Notes
+    -----
+
+    * the ERP file digests, the result cache and the pool of merp
+      workers are opened once and shared by all the command files, so
+      an ERP file named in many command files is hashed once and
+      measures repeated across command files come from the cache.
+
+    """
+    parsed = ((mcf, parse_merpfile(mcf)) for mcf in expand_merpfiles(mcfs))
+    for measurement in _iter_merp_files_records(
+        parsed, debug, batch, jobs, md5_store, cache, engine
+    ):
+        yield dict(measurement)
+
+
+def _iter_merp_files_records(parsed, debug, batch, jobs, md5_store, cache, engine):
+    """iter_merp_files() of (mcf, parse_merpfile(mcf)) 2-ples as MerpRecords"""
+    with _run_context(jobs, md5_store, cache) as (pool, result_cache):
+        for mcf, merp_cmds_list in parsed:
+            if debug:
+                _print_merp_cmds(mcf, merp_cmds_list)
+            yield from _iter_merp(
+                merp_cmds_list, mcf, batch, jobs, pool, result_cache, engine, debug
+            )
+
+
+# metadata columns that repeat a handful of values across the rows of a
+# run, interned when parsed and dictionary encoded in columnar output
+CATEGORICAL_KEYS = (
+    "subject_s",
+    "expt_s",
+    "condition_s",
+    "bin_desc_s",
+    "chan_desc_s",
+    "meas_label_s",
+    "meas_desc_s",
+    "units_s",
+    "erpfile_s",
+    "erp_md5_s",
+    "merpfile_s",
+    "baseline_s",
+)
+CATEGORICAL_COLUMNS = frozenset(key_fmt[:-2] for key_fmt in CATEGORICAL_KEYS)
+
+
+@functools.lru_cache(maxsize=None)
+def _record_fields(fields):
+    """(fields, field -> position) shared by all the records with these fields"""
+    return fields, dict((field, i) for i, field in enumerate(fields))
+
+
+class MerpRecord(collections.abc.MutableMapping):
+    """compact fixed-schema measurement or output row with a dict interface
+
+    The field names and their positions are shared by all the records
+    with the same fields, each record only holds a list of values, so
+    a million measurements don't carry a million copies of the key
+    table. Reads and writes by key work like a dict, adding or
+    deleting a key switches the record to the shared schema for the
+    new fields.
+
+    Records are the internal row type, from the merp output parser
+    through to the writers, the public functions return plain dicts.
+
+    Parameters
+    ----------
+    fields : iterable of str
+        field names, e.g., the parse_long_merp_output() keys
+    values : iterable
+        field values in the same order
+
+    """
+
+    __slots__ = ("_fields", "_index", "_values")
+
+    def __init__(self, fields, values):
+        self._fields, self._index = _record_fields(tuple(fields))
+        self._values = values if type(values) is list else list(values)
+        if len(self._values) != len(self._fields):
+            raise ValueError("record fields and values are different lengths")
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __setitem__(self, key, value):
+        idx = self._index.get(key)
+        if idx is None:
+            self._fields, self._index = _record_fields(self._fields + (key,))
+            self._values.append(value)
+        else:
+            self._values[idx] = value
+
+    def __delitem__(self, key):
+        idx = self._index[key]
+        fields = self._fields[:idx] + self._fields[idx + 1 :]
+        self._fields, self._index = _record_fields(fields)
+        del self._values[idx]
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return "MerpRecord({0!r})".format(dict(zip(self._fields, self._values)))
+
+    def copy(self):
+        return MerpRecord._make(self._fields, self._index, list(self._values))
+
+    @classmethod
+    def _make(cls, fields, index, values):
+        """new record from _record_fields() and a list of values, unchecked"""
+        record = cls.__new__(cls)
+        record._fields, record._index, record._values = fields, index, values
+        return record
+
+
+class LongMerpParser:
+    """compiled parser for long form merp output
+
+    The line patterns, their column names and the measure spec
+    pattern are compiled once when the class is instantiated, see
+    parse_long_merp_output() for the output format.
+
+    Notes
+    -----
+
+    * named regex capture groups define the row_dict keys
+
+    * merp long form output has a bug that farts out an extra 4 char
+      channel label on the first line. The reg exp takes the first four
+      characters of the channel label field, dropping the last 4, if
+      any. So MiPa -> MiPa and MiCeMiPa -> MiCe
+
+    """
+
+    # Define one regex pattern per output line for
+    # readibility/debugging
+
+    # line 1 work around double label merp bug
+    PATT1 = (
+        r"^Channel\s+"
+        r"(?P<chan_desc_s>.{4})(?:.{4})*\s+Sum of\s+"
+        r"(?P<epochs_d>\S+)"
+    )
+
+    # line 2 fixed length fields until the last.
+    PATT2 = (
+        r"^.+\n"
+        r"(?P<subject_s>.{41})"
+        r"(?P<bin_desc_s>.{40})"
+        r"(?P<condition_s>.{41})"
+        r"(?P<expt_s>.{40})"
+        r"(?P<meas_specs_s>.*)"
+        r"[\\\\n]*"
+    )
+
+    # line 3 may not exist, e.g., on bad baseline error
+    PATT3 = (
         r".+\n.+\n"
         r"(?P<meas_desc_s>.+?)"
         r"(?P<value_f>[-\.\d]+)\s"
         r"(?P<units_s>\S+$)"
     )
 
-    # scrape column names from the patterns and precompile
-    col_names, re_specs = [], []
-    for patt in [patt1, patt2, patt3]:
-        names = re.findall(r"\\?P<(.+?)>", patt)
-        col_names += names
-        re_specs.append((names, re.compile(patt)))
+    # the variable length meas_specs string
+    MEAS_PATT = (
+        r"^"
+        r"(?P<meas_label_s>\w+)\s+"
+        r"(?P<bin_d>\d+)\s+"
+        r"(?P<chan_d>\d+)\s+"
+        r"(?P<erpfile_s>\S+)\s+"
+        r"(?P<win_start_f>\d+)\s+"
+        r"(?P<win_stop_f>\d+)\s*"
+        r"(?P<meas_args_s>.*)"
+    )
+
+    def __init__(self):
+        self.line_regexes = [
+            re.compile(p) for p in [self.PATT1, self.PATT2, self.PATT3]
+        ]
+        self.meas_regex = re.compile(self.MEAS_PATT)
+        self.err_regex = re.compile(r"(?P<error>^.*)\n")
+        self.space_regex = re.compile(r"\s+")
+
+        # column names from the capture groups, in pattern order
+        self.col_names = [
+            name
+            for regex in self.line_regexes
+            for name, _ in sorted(regex.groupindex.items(), key=lambda kv: kv[1])
+        ]
+        self.meas_names = sorted(
+            self.meas_regex.groupindex, key=self.meas_regex.groupindex.get
+        )
+        assert len(self.meas_names) == 7
+
+        # measurement record fields, meas_specs_s is split into meas_names
+        self.fields = tuple(
+            [name for name in self.col_names if name != "meas_specs_s"]
+            + self.meas_names
+            + ["merp_error_s"]
+        )
+        self.value_idx = self.fields.index("value_f")
+        self.intern_idx = [
+            i for i, name in enumerate(self.fields) if name in CATEGORICAL_KEYS
+        ]
+
+    def parse(self, data_bytes, err_bytes):
+        """parse one measurement, see parse_long_merp_output()"""
+        tic = _tic()
+
+        # tabs aren't expected but strip in case
+        data = data_bytes.decode("utf-8").strip().replace("\t", " ")
+        err = err_bytes.decode("utf-8")
+
+        # if there is an error, first line is diagnostic
+        err_match = self.err_regex.match(err)
+        if err_match is not None:
+            # squeeze extra whitespace
+            err = self.space_regex.sub(" ", err_match.group("error"))
+
+        # init output dict to NA
+        row_dict = dict.fromkeys(self.col_names, "NA")
+
+        # First pass parse, override default 'NA' only on match
+        for regex in self.line_regexes:
+            matches = regex.match(data)
+            if matches is not None:
+                row_dict.update(matches.groupdict())
+
+        # parse the variable length meas_specs string
+        meas_specs = self.meas_regex.match(row_dict.pop("meas_specs_s")).groups()
+
+        # values in self.fields order
+        values = [v.strip() for v in row_dict.values()]
+        values += [v.strip() for v in meas_specs]
+
+        # one copy of each repeated metadata string, not one per row
+        for i in self.intern_idx:
+            values[i] = sys.intern(values[i])
+
+        # handle missing data
+        if err != "":
+            values[self.value_idx] = "NA"
+            values.append(err)
+        else:
+            values.append("NA")
+
+        # check measured value is convertible to numeric
+        if values[self.value_idx] != "NA":
+            float(values[self.value_idx])
+
+        _toc("parse", tic, len(data_bytes))
+        return MerpRecord(self.fields, values)
+
+    def parse_many(self, outputs):
+        """parse an iterable of (data_bytes, err_bytes) 2-ples, list of MerpRecord"""
+        return [self.parse(data_bytes, err_bytes) for data_bytes, err_bytes in outputs]
+
+
+LONG_MERP_PARSER = LongMerpParser()
+
+
+def parse_long_merp_output(data_bytes, err_bytes):
+    """parse long form merp output bytestring into a sensible dict
+
+    Parameters
+    ----------
+    data_bytes : byte string
+       one line of long form output merp sends to stdout
+    err_bytes : byte string
+       one line that merp sends to stderr, '' if all is well
+
+    Returns
+    -------
+    row_dict : dict
+        keys are column labels for the parsed output row, plus
+        the key 'err' for stderr status, 0 = ok, 1 = some error
+
+    Notes
+    -----
+
+    * this is LONG_MERP_PARSER.parse() as a plain dict, the regular
+      expressions are compiled once at import, see LongMerpParser. The
+      parser returns compact MerpRecords, used internally.
+
+    """
+    return dict(LONG_MERP_PARSER.parse(data_bytes, err_bytes))
+
+
+# map _fmt character to python data type
+SPEC_MAP = dict(s=str, f=float, d=int)
+
+
+def _na_or(dtype):
+    """converter from merp output string to dtype, 'NA' passes through"""
+
+    def convert(val_str):
+        return val_str if val_str == "NA" else dtype(val_str)
+
+    return convert
+
+
+@functools.lru_cache(maxsize=None)
+def _schema(key_fmts):
+    """resolve the output schema once per tuple of key_fmt column names
+
+    Returns
+    -------
+    schema : tuple of 3-ples
+        (key_fmt, key, converter) where key is key_fmt stripped of
+        '_fmt' and converter is None for strings, which including NA
+        don't need conversion
+    """
+    schema = []
+    for key_fmt in key_fmts:
+        key_spec = re.match("^(?P<key>.*)_(?P<spec>[fds])$", key_fmt)
+        assert key_spec is not None, key_fmt
+        key, spec = key_spec.group("key"), key_spec.group("spec")
+        schema.append((key_fmt, key, None if spec == "s" else _na_or(SPEC_MAP[spec])))
+    return tuple(schema)
+
+
+def _load_tags(tag_file, n_results):
+    """load and check the tag file, if any, {} if None
+
+    tag_file may also be tags already loaded with load_tagfile()
+    """
+    tags = dict()
+    if isinstance(tag_file, dict):
+        tags = tag_file
+        _check_tags(tags, "tags", n_results)
+    elif tag_file is not None:
+        tags = load_tagfile(tag_file)
+        _check_tags(tags, tag_file, n_results)
+    return tags
+
+
+def _check_tags(tags, tag_file, n_results):
+    """tags must be scalars or lists of 1 or n_results values, None skips the count
+
+    An empty list is never a good tag, whatever n_results is.
+    """
+    for k, v in tags.items():
+        if type(v) in [str, int, float]:
+            continue
+        if (
+            type(v) is list
+            and len(v) > 0
+            and (len(v) == 1 or n_results is None or len(v) == n_results)
+        ):
+            continue
+        _bad_tag(tag_file, k, v)
+
+
+def _bad_tag(tag_file, k, v):
+    msg = "bad tag in {0} ... {1}: {2}\n".format(tag_file, k, v)
+    msg += (
+        "value must be a single scalar value or "
+        "list of exactly as many values as measurements"
+    )
+    raise ValueError(msg)
+
+
+def iter_rows(results, tag_file=None, n_results=None):
+    """generate typed and tagged output row dicts one measurement at a time
+
+    Parameters
+    ----------
+    results : iterable of dict
+        as returned or generated by merp2tbl.run_merp(), iter_merp()
+    tag_file : str or dict (None)
+        path to YAML file with additional column:values, or the tags
+        already loaded with load_tagfile()
+    n_results : int (None)
+        number of results, if known, to check positional tags before
+        the first row instead of as the rows go by
+
+    Yields
+    ------
+    row : dict
+        keys stripped of the _fmt suffix, values converted to the python
+        data type, tags merged in
+    """
+
+    tags = _load_tags(tag_file, n_results)  # fail before the first row
+    return _iter_rows(results, tags, tag_file if isinstance(tag_file, str) else "tags")
+
+
+def _iter_rows(results, tags, tag_file):
+    """iter_rows() generator"""
+
+    # tag shapes are already checked, broadcast scalars and zip the
+    # positional lists into one tuple of tag values per row
+    tag_rows = itertools.repeat(())
+    if tags:
+        tag_cols = [
+            (
+                iter(v)
+                if type(v) is list and len(v) > 1
+                else itertools.repeat(v[0] if type(v) is list else v)
+            )
+            for v in tags.values()
+        ]
+        tag_rows = zip(*tag_cols)
+
+    schema, i = None, -1
+    for i, (r, tag_vals) in enumerate(zip(results, itertools.chain(tag_rows, [None]))):
+        # set the output data types, schema from the first row
+        if schema is None:
+            schema = _schema(tuple(r.keys()))
+            key_fmts = r.keys()
+            in_fields = tuple(key_fmts)
+            converts = [convert for _, _, convert in schema]
+            fields, index = _record_fields(tuple(key for _, key, _ in schema))
+
+            # tags go in new columns or replace measurement columns
+            tag_slots = []
+            for k in tags:
+                if k not in index:
+                    fields, index = _record_fields(fields + (k,))
+                tag_slots.append(index[k])
+            n_cols = len(schema)
+            tags_append = tag_slots == list(range(n_cols, n_cols + len(tag_slots)))
+
+        # same fields in the same order, convert by position
+        tic = _tic()
+        if type(r) is MerpRecord and (r._fields is in_fields or r._fields == in_fields):
+            values = [
+                v if convert is None else convert(v)
+                for v, convert in zip(r._values, converts)
+            ]
+        else:
+            assert r.keys() == key_fmts
+            values = [
+                r[key_fmt] if convert is None else convert(r[key_fmt])
+                for key_fmt, key, convert in schema
+            ]
+
+        _toc("convert", tic)
+
+        # set the external data data if any
+        if tag_vals is None:
+            _bad_positional_tags(tags, tag_file, i + 1)  # ran out of positional tags
+        if tags:
+            tic = _tic()
+            if tags_append:
+                values += tag_vals
+            else:
+                values += [None] * (len(fields) - n_cols)
+                for slot, v in zip(tag_slots, tag_vals):
+                    values[slot] = v
+            _toc("tags", tic)
+        yield MerpRecord._make(fields, index, values)
+
+    _bad_positional_tags(tags, tag_file, i + 1)
+
+
+def _bad_positional_tags(tags, tag_file, n_results):
+    """raise on the first positional tag list not n_results long"""
+    for k, v in tags.items():
+        if type(v) is list and len(v) > 1 and len(v) != n_results:
+            _bad_tag(tag_file, k, v)
+
+
+def iter_output(rows, fmt="tsv", out_keys=None, anchors=False):
+    """generate formatted output text, header first then one chunk per row
+
+    Parameters
+    ----------
+    rows : iterable of dict
+        as generated by iter_rows()
+    fmt : str ('tsv'), 'yaml'
+        specifies tab-separated rows x columns or yaml doc output
+    out_keys : list of str
+        whitelist of column names to report, default all in sorted order
+    anchors : bool
+        for yaml, write each CATEGORICAL_COLUMNS value once as a YAML
+        anchor and alias it in the rows after that, YAML readers load
+        the same document either way
+
+    Notes
+    -----
+
+    * "".join(iter_output(...)) is the format_output() text, each
+      TSV row and each YAML list item is generated separately.
+
+    """
+
+    # switch for the output type and dump
+    if fmt is None:
+        fmt = "tsv"
+    assert fmt in ["tsv", "yaml"]
+    if fmt == "yaml" and anchors:
+        yield from _iter_anchored_yaml(rows, out_keys)
+        return
+    if fmt == "yaml":
+        import yaml
+
+    fields, slots = None, None
+    for i, r in enumerate(rows):
+        # handle the output column filter
+        if out_keys is None:
+            out_keys = sorted(r.keys())
+
+        if i == 0 and fmt == "tsv":
+            # tab separate with header in out_key order
+            yield "\t".join(out_keys) + "\n"
+        if i == 0 and fmt == "yaml":
+            yield "# generated by merp2tbl\n---\n"
+
+        tic = _tic()
+        if fmt == "tsv" and type(r) is MerpRecord:
+            # look up the column positions once per record schema
+            if r._fields is not fields:
+                fields, slots = r._fields, [r._index[c] for c in out_keys]
+            values = r._values
+            chunk = ("\n" if i > 0 else "") + "\t".join([str(values[j]) for j in slots])
+        elif fmt == "tsv":
+            chunk = ("\n" if i > 0 else "") + "\t".join([str(r[c]) for c in out_keys])
+
+        if fmt == "yaml":
+            ro = dict((k, v) for k, v in r.items() if k in out_keys)
+            chunk = yaml.dump([ro], default_flow_style=False, canonical=False)
+        _toc("format", tic, len(chunk))
+        yield chunk
+
+
+@functools.lru_cache(maxsize=None)
+def _anchor_dumper():
+    """yaml.Dumper that anchors registered strings on first sight, aliases them after
+
+    The stock dumper only anchors nodes repeated within one document
+    it has seen whole, this one keeps its anchors across rows so the
+    document can be streamed.
+    """
+    import yaml
+
+    class AnchorDumper(yaml.Dumper):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.categories = dict()  # value -> the one str object anchored
+            self.category_nodes = set()
+
+        def ignore_aliases(self, data):
+            return not (type(data) is str and self.categories.get(data) is data)
+
+        def represent_data(self, data):
+            node = super().represent_data(data)
+            if not self.ignore_aliases(data):
+                self.category_nodes.add(node)
+            return node
+
+        def anchor_node(self, node):
+            if node in self.category_nodes:
+                if node not in self.anchors:
+                    self.anchors[node] = self.generate_anchor(node)
+            else:
+                super().anchor_node(node)
+
+    return AnchorDumper
+
+
+def _iter_anchored_yaml(rows, out_keys):
+    """iter_output() yaml with CATEGORICAL_COLUMNS values anchored and aliased"""
+    from yaml.events import (
+        DocumentEndEvent,
+        DocumentStartEvent,
+        SequenceEndEvent,
+        SequenceStartEvent,
+    )
+
+    buf, dumper = io.StringIO(), None
+    for r in rows:
+        if dumper is None:
+            if out_keys is None:
+                out_keys = sorted(r.keys())
+            yield "# generated by merp2tbl\n"
+            dumper = _anchor_dumper()(buf, default_flow_style=False, canonical=False)
+            dumper.open()
+            dumper.emit(DocumentStartEvent(explicit=True))
+            dumper.emit(
+                SequenceStartEvent(
+                    anchor=None, tag=None, implicit=True, flow_style=False
+                )
+            )
+
+        tic = _tic()
+        ro = dict((k, v) for k, v in r.items() if k in out_keys)
+        for k in CATEGORICAL_COLUMNS.intersection(ro):
+            if type(ro[k]) is str:
+                ro[k] = dumper.categories.setdefault(ro[k], ro[k])
+        node = dumper.represent_data(ro)
+        dumper.anchor_node(node)
+        dumper.serialize_node(node, None, None)
+        chunk = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        _toc("format", tic, len(chunk))
+        yield chunk
+
+    if dumper is not None:
+        dumper.emit(SequenceEndEvent())
+        dumper.emit(DocumentEndEvent(explicit=False))
+        dumper.close()
+        yield buf.getvalue()
+
+
+def format_output(
+    results,
+    mcf,
+    fmt="tsv",
+    out_keys=None,
+    tag_file=None,
+    validate="full",
+    anchors=False,
+):
+    """dump merp output to stdout in specified format
+
+    Parameters
+    ----------
+    results : list of dict
+        as returned by merp2tbl.run_merp()
+    mcf : str
+        path to merp file the output come from for data validation
+    fmt : str ('tsv'), 'yaml', 'parquet', 'feather'
+        specifies tab-separated rows x columns, yaml doc, or columnar
+        binary output
+    out_keys : list of str
+        whitelist of column names to report
+    tag_file : str or dict (None)
+        path to YAML file with additional column:values, or the tags
+        already loaded with load_tagfile()
+    validate : str ('full'), 'sample', 'off'
+        how to check the output values against merp -d, see validate_output()
+    anchors : bool
+        yaml output with repeated metadata as anchors and aliases, see
+        iter_output()
+
+    Returns
+    -------
+    output : str or bytes
+        text for tsv and yaml, bytes for parquet and feather
+
+    Notes
+    -----
+
+    * parquet and feather (Arrow IPC) column types follow the _f, _d,
+      _s key suffixes, see to_columns(). These require pyarrow.
+
+    """
+    if fmt in COLUMNAR_FORMATS:
+        sink = io.BytesIO()
+        write_output(results, mcf, sink, fmt, out_keys, tag_file, validate)
+        return sink.getvalue()
+
+    rows = iter_rows(results, tag_file=tag_file, n_results=len(results))
+    output = "".join(iter_output(rows, fmt=fmt, out_keys=out_keys, anchors=anchors))
+
+    # sanity check 0 == good, >0 == warnings, <0 == fail
+    vo, msg = validate_output(output, fmt, mcf, mode=validate)
+    if vo < 0:
+        raise RuntimeError(msg)
+    elif vo > 0:
+        warnings.warn(msg)
+
+    return output
+
+
+def write_output(
+    results,
+    mcf,
+    stream,
+    fmt="tsv",
+    out_keys=None,
+    tag_file=None,
+    validate="full",
+    n_results=None,
+    anchors=False,
+    merp_cmds=None,
+):
+    """stream merp output to a text file object row by row, then validate
+
+    Parameters are the same as format_output() plus
+
+    mcf : str or list of str
+        the merp command file, or files for iter_merp_files() results.
+        Each command file is validated against its own rows.
+    stream : file object
+        open text stream, e.g., sys.stdout, written and flushed one row
+        at a time. parquet and feather are written to its binary
+        buffer, or to stream itself if it is a binary file object
+    n_results : int (None)
+        number of results, if known, see iter_rows()
+    merp_cmds : MerpCommands or list of MerpCommands (None)
+        parse_merpfile() of mcf, or of each of the command files, if
+        the caller has them, so sample validation doesn't parse them
+        again
+
+    Notes
+    -----
+
+    * results may be a generator, e.g., iter_merp(), so each measurement
+      is converted, tagged, filtered and written as soon as merp
+      returns it. Only the output values are kept for validation.
+
+    * validation runs after the last row is written, so when it fails
+      the rows are already in stream before the RuntimeError. Write to
+      a temporary file and rename it afterwards, like -outdir does, to
+      keep rows that fail validation out of the output file.
+
+    """
+    if fmt is None:
+        fmt = "tsv"
+
+    values = collections.OrderedDict()  # merpfile -> output values
+    if fmt in COLUMNAR_FORMATS:
+        # binary, write to the underlying buffer of text streams
+        sink = getattr(stream, "buffer", stream)
+        _write_arrow(
+            results, sink, fmt, out_keys, _load_tags(tag_file, n_results), values
+        )
+        sink.flush()
+    else:
+        rows = iter_rows(results, tag_file=tag_file, n_results=n_results)
+        rows = (_tap_value(row, values) for row in rows)
+        for chunk in iter_output(rows, fmt=fmt, out_keys=out_keys, anchors=anchors):
+            tic = _tic()
+            stream.write(chunk)
+            stream.flush()
+            _toc("write", tic, len(chunk))
+        stream.write("\n")
+        stream.flush()
+
+    # sanity check 0 == good, >0 == warnings, <0 == fail
+    if out_keys is not None and "value" not in out_keys:
+        warnings.warn("{0} value column not found, cannot validate data".format(fmt))
+        return
+
+    if isinstance(mcf, str):
+        mcfs, values = [mcf], {mcf: list(itertools.chain(*values.values()))}
+        merp_cmds = [merp_cmds]
+    else:
+        mcfs = mcf
+        if merp_cmds is None:
+            merp_cmds = [None] * len(mcfs)
+    for mcf, mcf_cmds in zip(mcfs, merp_cmds):
+        vo, msg = _validate_values(
+            values.get(mcf, []), mcf, mode=validate, merp_cmds=mcf_cmds
+        )
+        if vo < 0:
+            raise RuntimeError(msg)
+        elif vo > 0:
+            warnings.warn(msg)
+
+
+def _tap_value(row, values):
+    """collect output values by command file for validation as the rows go by"""
+    values.setdefault(row["merpfile"], []).append(row["value"])
+    return row
+
+
+# ------------------------------------------------------------
+# columnar output
+# ------------------------------------------------------------
+
+COLUMNAR_FORMATS = ["parquet", "feather"]
+ARROW_BATCH_ROWS = 2**16  # rows per parquet row group or feather record batch
+
+
+def _import_pyarrow():
+    """pyarrow is only needed for parquet and feather output"""
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+        import pyarrow.feather  # noqa: F401
+    except ImportError as err:
+        msg = "parquet and feather output require pyarrow, e.g., conda install pyarrow"
+        raise ImportError(msg) from err
+    return pyarrow
+
+
+def _columns(results, tags=None, start=0, out_keys=None):
+    """transpose results into columns, unconverted
+
+    Parameters
+    ----------
+    results : list of dict
+        as returned by merp2tbl.run_merp()
+    tags : dict (None)
+        loaded and checked tags, see iter_rows()
+    start : int
+        index of results[0] in the whole run, for positional tags
+    out_keys : list of str (None)
+        column names and order, default all sorted
+
+    Returns
+    -------
+    columns : dict
+        column name -> (type character, list of values). The type
+        character is the key suffix, s, f, or d and the values the
+        merp output strings, 'NA' included, or None for tags and the
+        values the python tag values.
+    """
+    columns = dict()
+    if len(results) > 0:
+        schema = _schema(tuple(results[0].keys()))
+        fields = getattr(results[0], "_fields", None)
+        if all(type(r) is MerpRecord and r._fields == fields for r in results):
+            # same record schema, transpose the value lists in one go
+            transposed = zip(*(r._values for r in results))
+            for (key_fmt, key, _), values in zip(schema, transposed):
+                columns[key] = (key_fmt[-1], list(values))
+        else:
+            for key_fmt, key, _ in schema:
+                columns[key] = (key_fmt[-1], [r[key_fmt] for r in results])
+
+    for k, v in (tags or dict()).items():
+        if type(v) is list and len(v) > 1:
+            columns[k] = (
+                None,
+                v[start : start + len(results)],
+            )  # ith tag -> ith measurement
+        else:
+            v = v[0] if type(v) is list else v
+            columns[k] = (None, [v] * len(results))  # same tag all measurements
+
+    if out_keys is None:
+        out_keys = sorted(columns.keys())
+    return dict((k, columns[k]) for k in out_keys)
+
+
+def to_columns(results, tag_file=None, out_keys=None, frame=False):
+    """merp2tbl results as columns of NumPy arrays or a pandas DataFrame
+
+    Parameters
+    ----------
+    results : list of dict
+        as returned by merp2tbl.run_merp()
+    tag_file : str or dict (None)
+        path to YAML file with additional column:values, or the tags
+        already loaded with load_tagfile()
+    out_keys : list of str
+        whitelist of column names to report, default all in sorted order
+    frame : bool
+        if True return a pandas.DataFrame instead of a dict
+
+    Returns
+    -------
+    columns : dict or pandas.DataFrame
+        column names are stripped of the _fmt suffix like the TSV
+        header. Column dtypes follow the suffix: _f float64 with NaN for
+        NA, _d int64 (float64 with NaN if any NA, pandas Int64 in a
+        DataFrame), _s object arrays of str with None for NA
+        (CATEGORICAL_COLUMNS are pandas category in a DataFrame).
+
+    Notes
+    -----
+
+    * each column is converted in one NumPy pass, not value by value.
+
+    """
+    import numpy as np
+
+    results = list(results)
+    columns = _columns(results, _load_tags(tag_file, len(results)), 0, out_keys)
+    arrays = dict()
+    for key, (spec, values) in columns.items():
+        if spec is None:
+            arrays[key] = np.array(values)  # tags, numpy infers
+            if arrays[key].dtype.kind == "U":
+                arrays[key] = arrays[key].astype(object)
+            continue
+
+        arr = np.array(values, dtype=object)
+        is_na = arr == "NA"
+        if spec == "s":
+            arr[is_na] = None
+        elif spec == "d" and not is_na.any():
+            arr = arr.astype(np.int64)
+        else:
+            arr[is_na] = "nan"
+            arr = arr.astype(str).astype(np.float64)
+        arrays[key] = arr
+
+    if not frame:
+        return arrays
+
+    import pandas as pd
+
+    df = pd.DataFrame(arrays)
+    for key, (spec, values) in columns.items():
+        if spec == "d":
+            df[key] = df[key].astype("Int64")
+        elif spec == "s" and key in CATEGORICAL_COLUMNS:
+            df[key] = df[key].astype("category")
+    return df
+
+
+def _arrow_table(pa, columns, schema=None, dictionaries=None):
+    """pyarrow.Table from _columns(), typed by the key suffix or schema
+
+    Merp output columns are converted a whole column at a time by
+    pyarrow, NA to null. CATEGORICAL_COLUMNS are dictionary encoded,
+    dictionaries maps column names to the value codes so far, so
+    successive tables extend the same dictionaries.
+    """
+    import pyarrow.compute as pc
+
+    arrow_types = dict(s=pa.string(), f=pa.float64(), d=pa.int64())
+    arrays, names = [], []
+    for key, (spec, values) in columns.items():
+        arrow_type = arrow_types.get(spec)  # None infers tag types
+        if schema is not None:
+            arrow_type = schema.field(key).type
+        if spec is None:
+            arr = pa.array(values, type=arrow_type)
+        elif spec == "s" and key in CATEGORICAL_COLUMNS:
+            codes = dict() if dictionaries is None else dictionaries.setdefault(key, {})
+            indices = [
+                None if v == "NA" else codes.setdefault(v, len(codes)) for v in values
+            ]
+            arr = pa.DictionaryArray.from_arrays(
+                pa.array(indices, type=pa.int32()), pa.array(list(codes), pa.string())
+            )
+        else:
+            arr = pa.array(values, type=pa.string())
+            arr = pc.if_else(pc.equal(arr, "NA"), None, arr).cast(arrow_type)
+        arrays.append(arr)
+        names.append(key)
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def to_arrow(results, tag_file=None, out_keys=None):
+    """merp2tbl results as a pyarrow.Table, see to_columns() for the columns"""
+    pa = _import_pyarrow()
+    results = list(results)
+    tags = _load_tags(tag_file, len(results))
+    return _arrow_table(pa, _columns(results, tags, 0, out_keys))
+
+
+def _write_arrow(results, sink, fmt, out_keys, tags, values):
+    """write results to a binary sink as parquet or feather, ARROW_BATCH_ROWS at a time
+
+    The output values are collected in values by command file for validation.
+    """
+    pa = _import_pyarrow()
+
+    writer, schema, dictionaries = None, None, dict()
+    results = iter(results)
+    for start in itertools.count(0, ARROW_BATCH_ROWS):
+        batch = list(itertools.islice(results, ARROW_BATCH_ROWS))
+        if batch == [] and writer is not None:
+            break
+        tic = _tic()
+        columns = _columns(batch, tags, start, out_keys)
+        table = _arrow_table(pa, columns, schema, dictionaries)
+        if "value" in table.column_names:
+            for result, v in zip(batch, table.column("value").to_pylist()):
+                values.setdefault(result["merpfile_s"], []).append(
+                    "NA" if v is None else v
+                )
+        if writer is None:
+            schema = table.schema
+            if fmt == "parquet":
+                writer = pa.parquet.ParquetWriter(sink, schema)
+            else:
+                # feather files allow one dictionary per column, extended
+                # batch by batch with deltas
+                options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+                writer = pa.ipc.new_file(sink, schema, options=options)
+        writer.write_table(table)
+        _toc("arrow", tic, table.nbytes)
+        if len(batch) < ARROW_BATCH_ROWS:
+            break
+    writer.close()
+
+
+VALIDATE_MODES = ["full", "sample", "off"]
+VALIDATE_SAMPLE_K = 10  # rows checked in sample mode
+
+
+def _validate_mode(mode):
+    """True if mode checks the output, False for 'off', ValueError if unknown"""
+    if mode not in VALIDATE_MODES:
+        raise ValueError(
+            "validate mode must be one of {0}: {1}".format(VALIDATE_MODES, mode)
+        )
+    return mode != "off"
+
+
+def validate_output(output, fmt, mcf, mode="full", k=VALIDATE_SAMPLE_K, seed=None):
+    """compare values in merp2tbl output with merp -d row for row, non-NA must agree
+
+    Parameters
+    ----------
+    output : dict
+       as returned by format_output
+    fmt : str
+       'tsv' or 'yaml'
+    mcf : str
+       path to merp command file
+    mode : str ('full'), 'sample', 'off'
+       'full' reruns merp -d on the whole command file, 'sample'
+       reruns merp -d on k randomly chosen measurements only, 'off'
+       skips validation
+    k : int
+       number of measurements to check in sample mode
+    seed : int (None)
+       random seed for the sample mode row choice
+
+    Returns
+    -------
+      rval, msg : 2-ple of int, str
+        rval 0 = success, positive = warning, negative = fail
+        msg = brief explanation
+
+    Notes
+    -----
+
+    * full validation measures everything a second time, sample mode
+      costs k short merp runs regardless of the size of the command file.
+
+    """
+    if not _validate_mode(mode):
+        return (0, "")
+
+    merp2tbl_vals, fail = _output_values(output, fmt)
+    if fail is not None:
+        return fail
+    return _validate_values(merp2tbl_vals, mcf, mode, k, seed)
+
+
+def _output_values(output, fmt):
+    """validate_output() values, float or 'NA', and None, or None and the failure"""
+
+    merp2tbl_vals = []
+    if fmt == "yaml":
+        import yaml
+
+        for out in yaml.load(output, Loader=yaml.SafeLoader):
+            if "value" in out.keys():
+                merp2tbl_vals.append(out["value"])
+            else:
+                msg = "yaml value key not found, cannot validate data"
+                return None, (1, msg)
+
+    elif fmt == "tsv":
+        out_lines = output.split("\n")
+        header = out_lines[0].split("\t")
+        value_idx = None
+        try:
+            value_idx = header.index("value")
+        except ValueError:
+            msg = "tsv value column not found, cannot validate data"
+            return None, (2, msg)
+
+        if value_idx is not None:
+            merp2tbl_vals = [
+                out_line.split("\t")[value_idx] for out_line in out_lines[1:]
+            ]
+            merp2tbl_vals = [v if v == "NA" else float(v) for v in merp2tbl_vals]
+    else:
+        raise ValueError("unknown format: ", fmt)
+
+    if merp2tbl_vals == []:
+        msg = "no merp2tbl values not found, cannot validate data"
+        return None, (1, msg)
+
+    return merp2tbl_vals, None
+
+
+def _validate_values(
+    merp2tbl_vals, mcf, mode="full", k=VALIDATE_SAMPLE_K, seed=None, merp_cmds=None
+):
+    """validate_output() on the list of output values, float or 'NA'
+
+    merp_cmds is parse_merpfile(mcf) if the caller has it, for sample mode
+    """
+
+    if not _validate_mode(mode):
+        return (0, "")
+
+    tic = _tic()
+    try:
+        if mode == "sample":
+            return _validate_sample(merp2tbl_vals, mcf, k, seed, merp_cmds)
+        return _validate_full(merp2tbl_vals, mcf)
+    finally:
+        _toc("validate", tic)
+
+
+def _validate_full(merp2tbl_vals, mcf):
+    """_validate_values() against merp -d on the whole command file"""
+
+    # run merp -d and slurp values
+    proc_res = subprocess.run(
+        ["merp", "-d", mcf], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    return _compare_full(merp2tbl_vals, proc_res.stdout, mcf)
+
+
+def _compare_full(merp2tbl_vals, stdout, mcf):
+    """compare the output values with the merp -d stdout for the whole command file"""
+
+    if _PROFILER is not None:
+        _PROFILER.add("validate", 0.0, 0.0, len(stdout), calls=0)
+
+    merp_vals = [
+        float(v) for v in stdout.decode("utf-8").split("\n") if len(v.strip()) > 0
+    ]
+
+    # length mismatch
+    if len(merp_vals) != len(merp2tbl_vals):
+        msg = "merp2tbl " + mcf + " output value length mismatch"
+        return (-1, msg)
+
+    # check value for value, skip NAs
+    for i, v in enumerate(merp2tbl_vals):
+        if v != "NA" and not merp_vals[i] == merp2tbl_vals[i]:
+            msg = "merp2tbl {0} output line {1}: {2} != merp -d {3}".format(
+                mcf, i, merp2tbl_vals[i], merp_vals[i]
+            )
+            return (-2, msg)
+    return (0, "")
+
+
+def _validate_sample(merp2tbl_vals, mcf, k, seed, merp_cmds=None):
+    """validate_output() for k random non-NA rows, one merp -d - run per row"""
+
+    sample, fail = _sample_cmds(merp2tbl_vals, mcf, k, seed, merp_cmds)
+    if fail is not None:
+        return fail
+    for i, cmd_str in sample:
+        stdout, _ = _merp_stdin(cmd_str, short=True)
+        fail = _compare_sample(merp2tbl_vals, i, stdout, mcf)
+        if fail is not None:
+            return fail
+    return (0, "")
+
+
+def _sample_cmds(merp2tbl_vals, mcf, k, seed, merp_cmds_list=None):
+    """(row, merp command lines) to sample and None, or None and the failure 2-ple"""
+
+    if merp_cmds_list is None:
+        merp_cmds_list = parse_merpfile(mcf)
+    if len(merp_cmds_list) != len(merp2tbl_vals):
+        msg = "merp2tbl " + mcf + " output value length mismatch"
+        return None, (-1, msg)
+
+    rows = [i for i, v in enumerate(merp2tbl_vals) if v != "NA"]
+    rows = sorted(random.Random(seed).sample(rows, min(k, len(rows))))
+    return [(i, _merp_cmd_str(merp_cmds_list[i])) for i in rows], None
+
+
+def _compare_sample(merp2tbl_vals, i, stdout, mcf):
+    """compare output row i with its merp -d stdout, None if they agree"""
+
+    merp_vals = [float(v) for v in stdout.decode("utf-8").split("\n") if v.strip()]
+    if merp_vals != [merp2tbl_vals[i]]:
+        msg = "merp2tbl {0} output line {1}: {2} != merp -d {3}".format(
+            mcf, i, merp2tbl_vals[i], merp_vals
+        )
+        return (-2, msg)
+    return None
+
+
+# ------------------------------------------------------------
+# asyncio
+# ------------------------------------------------------------
+
+
+async def run_merp_async(mcf, debug=False, batch=False, concurrency=1):
+    """run_merp() for asyncio event loops, merp runs as an asyncio subprocess
+
+    Parameters
+    ----------
+    mcf : string
+        path to merp command file
+    debug : bool
+        if true reports internal command dict before running merp
+    batch : bool
+        if true run all the measures on the same file and baseline
+        through one merp process, see run_merp()
+    concurrency : int
+        maximum number of merp processes to run at the same time
+
+    Returns
+    -------
+    measurements : list of dict
+        same as run_merp(), in canonical merp order
+
+    Notes
+    -----
+
+    * the command file is expanded and the merp output parsed the same
+      way as run_merp(), only waiting on merp is handed to the event
+      loop so the loop keeps serving other tasks meanwhile.
 
-    # init output dict to NA
-    row_dict = dict([(col, "NA") for col in col_names])
+    * if the task is cancelled or a measurement fails, the measurements
+      in flight are cancelled and their merp processes killed before
+      the CancelledError or RuntimeError propagates.
 
-    # First pass parse, override default 'NA' only on match
-    for names, regex in re_specs:
-        matches = None
-        matches = regex.match(data)
-        if matches is not None:
-            row_dict.update(matches.groupdict())
+    * the ERP file digest store and the result cache are not used,
+      their file and sqlite I/O would block the loop. The merp output
+      is parsed and the ERP files hashed in the loop's default
+      executor.
 
-    # parse the variable length meas_specs string
-    meas_regex = re.compile(
-        r"^"
-        r"(?P<meas_label_s>\w+)\s+"
-        r"(?P<bin_d>\d+)\s+"
-        r"(?P<chan_d>\d+)\s+"
-        r"(?P<erpfile_s>\S+)\s+"
-        r"(?P<win_start_f>\d+)\s+"
-        r"(?P<win_stop_f>\d+)\s*"
-        r"(?P<meas_args_s>.*)"
+    """
+    import asyncio
+
+    if not isinstance(concurrency, int) or concurrency < 1:
+        raise ValueError(
+            "concurrency must be a positive integer: {0}".format(concurrency)
+        )
+
+    merp_cmds_list = parse_merpfile(mcf)
+    if debug:
+        _print_merp_cmds(mcf, merp_cmds_list)
+
+    # every measurement is held to the end, each repeat in the window is copied
+    repeats = _Repeats(DEDUP_WINDOW)
+    todo = repeats.iter_unique(enumerate(merp_cmds_list))
+    if batch:
+        units = iter(_group_merp_cmds(todo))
+    else:
+        units = (([idx], [merp_cmds]) for idx, merp_cmds in todo)
+
+    # concurrency workers take turns drawing units from the shared iterator
+    measurements = [None] * len(merp_cmds_list)
+
+    async def worker():
+        for idxs, merp_cmds_group in units:
+            results = await _measure_batch_async(merp_cmds_group, mcf)
+            for idx, measurement in zip(idxs, results):
+                measurements[idx] = measurement
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+    for idx, first_idx in repeats.dups.items():
+        measurements[idx] = measurements[first_idx].copy()
+    if debug:
+        repeats.report(mcf)
+    return [dict(measurement) for measurement in measurements]
+
+
+async def validate_output_async(
+    output, fmt, mcf, mode="full", k=VALIDATE_SAMPLE_K, seed=None
+):
+    """validate_output() for asyncio event loops, merp -d as an asyncio subprocess"""
+
+    if not _validate_mode(mode):
+        return (0, "")
+
+    merp2tbl_vals, fail = _output_values(output, fmt)
+    if fail is not None:
+        return fail
+
+    tic = _tic()
+    try:
+        if mode == "full":
+            stdout, _ = await _merp_async(["merp", "-d", mcf], None)
+            return _compare_full(merp2tbl_vals, stdout, mcf)
+
+        # parsing a large command file would hold up the loop
+        sample, fail = await _in_thread(_sample_cmds, merp2tbl_vals, mcf, k, seed)
+        if fail is not None:
+            return fail
+        for i, cmd_str in sample:
+            stdout, _ = await _merp_stdin_async(cmd_str, short=True)
+            fail = _compare_sample(merp2tbl_vals, i, stdout, mcf)
+            if fail is not None:
+                return fail
+        return (0, "")
+    finally:
+        _toc("validate", tic)
+
+
+async def _merp_async(args, stdin_bytes):
+    """run merp args with stdin_bytes as an asyncio subprocess, return stdout, stderr
+
+    merp is killed if the awaiting task is cancelled.
+    """
+    import asyncio
+
+    merp_proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=subprocess.DEVNULL if stdin_bytes is None else subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
     )
+    try:
+        return await merp_proc.communicate(stdin_bytes)
+    except BaseException:
+        if merp_proc.returncode is None:
+            merp_proc.kill()
+            await merp_proc.wait()
+        raise
+
+
+async def _merp_stdin_async(cmd_str, short=False):
+    """_merp_stdin() as an asyncio subprocess"""
+    tic = _tic()
+    stdout, stderr = await _merp_async(
+        ["merp", "-d", "-"] if short else ["merp", "-"], cmd_str.encode("utf-8")
+    )
+    _toc("merp", tic, len(stdout) + len(stderr))
+    return stdout, stderr
 
-    meas_specs = meas_regex.match(row_dict["meas_specs_s"]).groupdict()
-    assert len(meas_specs) == 7
 
-    # add the new items
-    kvs = [(k, v) for d in [row_dict, meas_specs] for k, v in d.items()]
-    for k, v in kvs:
-        row_dict[k] = v.strip()
+async def _in_thread(func, *args):
+    """await func(*args) run in the loop's default executor, e.g., to hash ERP files"""
+    import asyncio
 
-    # drop the redundant bin and parsed chunks
-    del row_dict["meas_specs_s"]
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
 
-    # handle missing data
-    if re.match(".+", err):
-        row_dict["value_f"] = "NA"
-        row_dict["merp_error_s"] = err
-    else:
-        row_dict["merp_error_s"] = "NA"
 
-    # check measured value is convertible to numeric
-    if row_dict["value_f"] != "NA":
-        float(row_dict["value_f"])
+async def _measure_batch_async(merp_cmds_group, mcf):
+    """_measure_batch() with merp as an asyncio subprocess
+
+    The output is parsed and logged off the event loop, erp_md5() may
+    hash a large ERP file.
+    """
+    if len(merp_cmds_group) > 1:
+        stdout, stderr = await _merp_stdin_async(_batch_cmd_str(merp_cmds_group))
+        measurements = await _in_thread(
+            _batch_output, stdout, stderr, merp_cmds_group, mcf
+        )
+        if measurements is not None:
+            return measurements
+
+    measurements = []
+    for merp_cmds in merp_cmds_group:
+        cmd_str = _merp_cmd_str(merp_cmds)
+        stdout, stderr = await _merp_stdin_async(cmd_str)
+        measurements.append(
+            await _in_thread(_measure_output, stdout, stderr, cmd_str, merp_cmds, mcf)
+        )
+    return measurements
 
-    return row_dict
 
+# ------------------------------------------------------------
+# native measurements
+# ------------------------------------------------------------
 
-def format_output(results, mcf, fmt="tsv", out_keys=None, tag_file=None):
-    """dump merp output to stdout in specified format
+ENGINES = ["merp", "native", "native-all"]
+
+# ERPSS average (.avg) and normalized average (.nrm) files are one block
+# per bin, starting with the cal bin 0: a 512 byte header of int16 words
+# and strings, then the samples channel by channel.
+ERP_MAGIC = -26715  # header word 0
+ERP_HEADER_WORDS = 256
+ERP_NPOINTS = 256  # samples per channel
+ERP_UNITS_PER_UV = 100  # sample units per microvolt, calibrated against merp
+ERP_CACHE_FILES = 32  # ERP files kept mapped, least recently used are dropped
+WAVEFORM_CACHE_BYTES = 2**27  # baseline corrected waveforms kept, 128 MB
+
+# (meas_desc, units) of the measures the native engine can compute,
+# other measures go to merp
+NATIVE_MEASURES = {
+    "meana": ("mean amplitude", "uVolts"),
+    "rms": ("rms amplitude", "uVolts"),
+    "pkl": ("peak latency", "milliseconds"),
+    "pka": ("peak amplitude", "uVolts"),
+    "lpkl": ("local peak latency", "milliseconds"),
+    "lpka": ("local peak amplitude", "uVolts"),
+    "fal": ("fractional area latency", "milliseconds"),
+    "faa": ("fractional area amplitude", "uVolts"),
+    "centroid": ("centroid latency", "milliseconds"),
+    "slope": ("slope", "uVolts/ms"),
+}
+
+# measures checked against the merp gold tables in tests/data, engine
+# "native" computes only these. The labels, units and error messages of
+# the others are unchecked, engine "native-all" opts in to them.
+NATIVE_CALIBRATED = frozenset(["meana", "fal", "lpkl", "lpka"])
+
+
+class ErpFile:
+    """ERPSS .avg or .nrm ERP average file, memory-mapped read only
 
     Parameters
     ----------
-    results : list of dict
-        as returned by merp2tbl.run_merp()
-    mcf : str
-        path to merp file the output come from for data validation
-    fmt : str ('tsv'), 'yaml'
-        specifies tab-separated rows x columns or yaml doc output
-    out_keys : list of str
-        whitelist of column names to report
-    tag_file : str (None)
-        path to YAML file with additional column:values
+    path : str
+       path to the ERP file
+    md5 : str (None)
+       erp_md5() digest of the file, identifies the file version in the
+       WaveformCache, waveforms of an ErpFile without one aren't cached
+
+    Attributes
+    ----------
+    data : numpy.ndarray of int16
+       samples, shape (bins, channels, points), bin 0 is the cal bin.
+       A read only view of the mapped file, only the pages measured
+       are read from disk
+    headers : numpy.ndarray of int16
+       header words, shape (bins, 256)
+    chan_descs : list of str
+       channel labels
+    period_ms : float
+       sampling period
+    presampling_ms : float
+       prestimulus interval, the first sample is at -presampling_ms
+
+    Raises
+    ------
+    ValueError
+       if path isn't an ERP average file
 
     Notes
     -----
 
+    * header words: 2 = number of channels, 3 = number of epochs summed,
+      9 = sampling period in 10 microsecond ticks, 13 = presampling
+      in milliseconds
+
+    * header strings: 0x80 = 4 character channel labels, 0x100 =
+      subject, 0x128 = bin description, 0x150 = condition, 0x178 =
+      experiment, 40 characters each
+
+    * use open_erp() to share one mapping per file version.
+
     """
 
-    # helper to convert the merp string output to python scalar types
-    def spec2dtype(key_fmt, val_str):
-        """ converts val_str to data type according to _fmt, returns key, val 2-ple """
+    def __init__(self, path, md5=None):
+        import numpy as np
+
+        self.path = path
+        self.md5 = md5
+        # plain ndarray views index faster than the memmap subclass
+        raw = np.memmap(path, dtype="<i2", mode="r").view(np.ndarray)
+        if len(raw) < ERP_HEADER_WORDS or raw[0] != ERP_MAGIC:
+            raise ValueError("not an ERPSS average file: " + path)
+        nchans = int(raw[2])
+        block_words = ERP_HEADER_WORDS + nchans * ERP_NPOINTS
+        if nchans < 1 or len(raw) % block_words:
+            raise ValueError("bad ERPSS average file size: " + path)
+
+        blocks = raw.reshape(-1, block_words)
+        self.headers = blocks[:, :ERP_HEADER_WORDS]
+        self.data = blocks[:, ERP_HEADER_WORDS:].reshape(-1, nchans, ERP_NPOINTS)
+        self.period_ms = int(raw[9]) / 100.0
+        self.presampling_ms = float(raw[13])
+        labels = self._header_bytes(0)[0x80 : 0x80 + 4 * nchans]
+        self.chan_descs = [
+            self._decode(labels[i : i + 4]) for i in range(0, len(labels), 4)
+        ]
+
+    def _header_bytes(self, bin_n):
+        return self.headers[bin_n].tobytes()
+
+    @staticmethod
+    def _decode(field):
+        return field.split(b"\0")[0].decode("latin-1").strip()
+
+    def bin_info(self, bin_n):
+        """epochs, subject, bin_desc, condition, expt strings of bin_n, like merp"""
+        header = self._header_bytes(bin_n)
+        return [str(int(self.headers[bin_n][3]))] + [
+            self._decode(header[offset : offset + 40])
+            for offset in (0x100, 0x128, 0x150, 0x178)
+        ]
+
+    def index(self, msecs):
+        """sample index of the latency msecs, the sample at or before it"""
+        return math.floor((msecs + self.presampling_ms) / self.period_ms)
+
+    def latency(self, idx):
+        """latency in milliseconds of sample index idx"""
+        return idx * self.period_ms - self.presampling_ms
+
+
+def open_erp(erpfile):
+    """the ErpFile for erpfile, mapped once per file version
 
-        spec_map = dict(s=str, f=float, d=int)  # map _fmt character to python data type
+    Parameters
+    ----------
+    erpfile : str
+       path to the ERP file
+
+    Returns
+    -------
+    erp : ErpFile
+
+    Notes
+    -----
+
+    * mappings are kept in a least recently used cache of
+      ERP_CACHE_FILES keyed on the real path and the erp_md5() digest,
+      the same digest as the erp_md5_s column, so all the channels and
+      measures of a command file on the same ERP file share one
+      mapping and a file that changes gets a new one.
+
+    """
+    return _open_erp(os.path.realpath(erpfile), erp_md5(erpfile))
+
+
+@functools.lru_cache(maxsize=ERP_CACHE_FILES)
+def _open_erp(path, md5):
+    """open_erp() cache, the digest is only part of the key"""
+    return ErpFile(path, md5)
+
+
+def _erp_baseline(erp, baseline):
+    """(start, stop) sample slice for a baseline command, None for nobaseline
+
+    The default merp baseline is the prestimulus interval.
+    """
+    if baseline == "nobaseline":
+        return None
+    if baseline == "default":
+        return 0, erp.index(0)
+    _, start, stop = baseline.split(" ")
+    return erp.index(float(start)), erp.index(float(stop))
+
+
+def _polarity(args):
+    """+1 or -1 for the leading + or - measure argument, default +"""
+    if args and args[0] in ("+", "-"):
+        return -1 if args[0] == "-" else 1, args[1:]
+    return 1, args
 
-        # parse key_fmt
-        key_spec = re.match("^(?P<key>.*)_(?P<spec>[fds])$", key_fmt)
-        assert key_spec.groupdict()["spec"] in spec_map.keys()
 
-        key = key_spec.groupdict()["key"]  # == key_fmt stripped of '_fmt'
+def _corrected_waveforms(erp, bin_n, span):
+    """(channels, points) float waveforms of bin_n minus the merp baseline of span
 
-        # strings including NA don't need conversion
-        if key_spec.groupdict()["spec"] == "s" or val_str == "NA":
-            val = val_str
+    The baseline is the mean of the span truncated to integer sample
+    units, the array is read only.
+    """
+    import numpy as np
+
+    waveforms = erp.data[bin_n].astype(float)
+    if span is not None:
+        start, stop = span
+        if not 0 <= start < stop <= ERP_NPOINTS:
+            raise ValueError("baseline out of range")
+        waveforms -= np.trunc(waveforms[:, start:stop].mean(axis=1))[:, None]
+    waveforms.setflags(write=False)
+    return waveforms
+
+
+class WaveformCache:
+    """baseline corrected waveforms shared by the measures on them
+
+    Keyed on (ERP file digest, bin, baseline sample span) so every
+    measure and channel on the same file version, bin and baseline
+    reuses one corrected (channels, points) array. Baselines that pick
+    the same samples, like default and the prestimulus interval, share
+    an entry.
+
+    Parameters
+    ----------
+    max_bytes : int
+       evict least recently used waveforms when the arrays exceed this size
+
+    """
+
+    def __init__(self, max_bytes=WAVEFORM_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits, self.misses = 0, 0
+        self._waveforms = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, erp, bin_n, baseline):
+        """read only corrected waveforms of bin_n for a baseline command
+
+        Raises
+        ------
+        ValueError
+           if the baseline is outside the epoch
+
+        """
+        span = _erp_baseline(erp, baseline)
+        key = (erp.md5, bin_n, span)
+        with self._lock:
+            if key in self._waveforms:
+                self._waveforms.move_to_end(key)
+                self.hits += 1
+                return self._waveforms[key]
+            self.misses += 1
+
+        waveforms = _corrected_waveforms(erp, bin_n, span)
+        if erp.md5 is None:
+            return waveforms
+        with self._lock:
+            if key not in self._waveforms and waveforms.nbytes <= self.max_bytes:
+                self._waveforms[key] = waveforms
+                self.nbytes += waveforms.nbytes
+                while self.nbytes > self.max_bytes:
+                    _, evicted = self._waveforms.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+        return waveforms
+
+    def clear(self):
+        with self._lock:
+            self._waveforms.clear()
+            self.nbytes = 0
+
+
+WAVEFORM_CACHE = WaveformCache()
+
+
+def _native_values(meas, erp, x, lo, hi, args):
+    """(value, error) strings for measure meas on each baseline corrected waveform
+
+    x is in sample units, shape (channels, points), lo and hi are the
+    first and last sample index of the measurement window. The
+    channels are measured at once, one array operation along the
+    sample axis.
+    """
+    import numpy as np
+
+    sign, args = _polarity(args)
+    window = x[:, lo : hi + 1]
+    rows = np.arange(len(x))
+
+    def amplitudes(values):
+        return [("{0:.2f}".format(v / ERP_UNITS_PER_UV), "NA") for v in values]
+
+    def latencies(idxs):
+        return [("{0:.0f}".format(erp.latency(i)), "NA") for i in idxs]
+
+    def at(idxs):
+        # pkl, lpkl, fal are latencies, pka, lpka, faa the amplitudes there
+        return latencies(idxs) if meas.endswith("l") else amplitudes(x[rows, idxs])
+
+    def last_argmax(y):
+        # the last of equal maxima, like merp
+        return y.shape[1] - 1 - np.argmax(y[:, ::-1], axis=1)
+
+    if meas == "meana":
+        return amplitudes(window.mean(axis=1))
+
+    if meas == "rms":
+        return amplitudes(np.sqrt(np.mean(window**2, axis=1)))
+
+    if meas == "slope":
+        times = erp.latency(np.arange(lo, hi + 1))
+        return amplitudes(np.polyfit(times, window.T, 1)[0])
+
+    if meas in ("pkl", "pka"):
+        return at(lo + last_argmax(sign * window))
+
+    if meas in ("lpkl", "lpka"):
+        # greater than each of the n samples on either side
+        n = int(args[0])
+        y = sign * x
+        peaks = np.arange(max(lo, n), min(hi, x.shape[1] - n - 1) + 1)
+        if not len(peaks):
+            return [("NA", "lpk - no local maximum.")] * len(x)
+        is_peak = np.ones((len(x), len(peaks)), dtype=bool)
+        for d in range(1, n + 1):
+            is_peak &= (y[:, peaks] > y[:, peaks - d]) & (y[:, peaks] > y[:, peaks + d])
+        idxs = peaks[last_argmax(np.where(is_peak, y[:, peaks], -np.inf))]
+        return [
+            value if found else ("NA", "lpk - no local maximum.")
+            for value, found in zip(at(idxs), is_peak.any(axis=1))
+        ]
+
+    if meas in ("fal", "faa", "centroid"):
+        area = np.clip(sign * window, 0, None)
+        total = area.sum(axis=1)
+        error = ("NA", "centroid - no area." if meas == "centroid" else "fa - no area.")
+        if meas == "centroid":
+            times = erp.latency(np.arange(lo, hi + 1))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values = [
+                    ("{0:.0f}".format(v), "NA")
+                    for v in (area * times).sum(axis=1) / total
+                ]
         else:
-            # coerce string to float or int
-            val = spec_map[key_spec.groupdict()["spec"]](val_str)
-        return key, val
+            # first sample where the area of the samples before it reaches the fraction
+            before = np.cumsum(area, axis=1) - area
+            values = at(
+                lo + np.argmax(before >= float(args[0]) * total[:, None], axis=1)
+            )
+        return [error if t == 0 else value for value, t in zip(values, total)]
 
-    # set the output data types
-    results = [dict([spec2dtype(k, v) for k, v in r.items()]) for r in results]
+    raise NotImplementedError(meas)
 
-    # set the external data data if any
-    if tag_file is not None:
-        tags = load_tagfile(tag_file)
 
-        # update results with the tags ... we could prescreen
-        # more quickly but this allows diagnostic output on fail
-        for k, v in tags.items():
-            for i, r in enumerate(results):
-                if type(v) in [str, int, float]:
-                    r.update({k: v})
-                elif type(v) is list and len(v) == 1:
-                    r.update({k: v[0]})  # same tag all measurements
-                elif type(v) is list and len(v) == len(results):
-                    r.update({k: v[i]})  # ith tag -> ith measurement
-                else:
-                    msg = "bad tag in {0} ... {1}: {2}\n".format(tag_file, k, v)
-                    msg += (
-                        "value must be a single scalar value or "
-                        "list of exactly as many values as measurements"
-                    )
-                    raise ValueError(msg)
+def _channel_key(merp_cmds):
+    """(command 3-ple with the channel replaced by $, channel string)
 
-    assert all(r.keys() == results[0].keys() for r in results)
+    Commands with the same key differ only in channel, like the
+    expansion of a $ measure, and are measured together natively.
+    """
+    file_cmd, baseline, cmd_str = merp_cmds
+    fields = cmd_str.split(" ")
+    if len(fields) < 3:
+        return merp_cmds, None
+    chan_s, fields[2] = fields[2], "$"
+    return (file_cmd, baseline, " ".join(fields)), chan_s
 
-    # handle the output column filter
-    if out_keys is None:
-        out_keys = sorted(results[0].keys())
 
-    results_out = []
-    for r in results:
-        ro = dict()
-        for k, v in r.items():
-            if k in out_keys:
-                ro.update({k: v})
-        results_out.append(ro)
+def _group_expansions(indexed_cmds):
+    """group adjacent (index, command 3-ple) that differ only in channel and ERP file
 
-    # switch for the output type and dump
-    if fmt is None:
-        fmt = "tsv"
-    assert fmt in ["tsv", "yaml"]
+    A $ or * measure line expands to adjacent commands, channels by
+    files, unlike _group_merp_cmds() the groups stream.
+    """
 
-    if fmt == "tsv":
-        # tab separate with header in out_key order
-        header = "\t".join(out_keys) + "\n"
-        data = "\n".join(
-            ["\t".join([str(r[c]) for c in out_keys]) for r in results_out]
-        )
-        output = header + data
+    def line_key(merp_cmds):
+        fields = merp_cmds[2].split(" ")
+        return merp_cmds[1], fields[:2] + fields[4:]
 
-    if fmt == "yaml":
-        output = "# generated by merp2tbl\n"
-        output += yaml.dump(
-            results_out, explicit_start=True, default_flow_style=False, canonical=False,
-        )
+    for _, group in itertools.groupby(indexed_cmds, lambda x: line_key(x[1])):
+        idxs, merp_cmds_group = zip(*group)
+        yield list(idxs), list(merp_cmds_group)
 
-    # sanity check 0 == good, >0 == warnings, <0 == fail
-    vo, msg = validate_output(output, fmt, mcf)
-    if vo < 0:
-        raise RuntimeError(msg)
-    elif vo > 0:
-        warnings.warn(msg)
 
-    return output
+def measure_native(merp_cmds, measures=NATIVE_CALIBRATED):
+    """measure a command 3-ple in-process, None if it has to go to merp
 
+    Parameters
+    ----------
+    merp_cmds : 3-ple of str
+       (file, baseline, measure) as parsed by parse_merpfile()
+    measures : collection of str (NATIVE_CALIBRATED)
+       measures to compute, NATIVE_MEASURES to include the ones not
+       checked against merp
 
-def validate_output(output, fmt, mcf):
-    """compare values in merp2tbl output with merp -d row for row, non-NA must agree
+    Returns
+    -------
+    measurement : dict or None
+       same fields and values as parse_long_merp_output() of the merp
+       output, before _log_measurement() adds the run columns. None if
+       the measure isn't in measures or the command, ERP file,
+       or baseline isn't one the native engine handles, so merp can
+       measure it or report the error.
+
+    Notes
+    -----
+
+    * calibrated against merp on the test ERP files for meana, fal,
+      lpkl, and lpka with default, explicit, and no baselines. The
+      other NATIVE_MEASURES follow the same conventions but their
+      values, labels and error messages aren't checked. Samples
+      are at i * period - presampling, a window includes the samples
+      at or before its start and stop latencies, the baseline span
+      excludes the stop sample, the baseline is truncated to integer
+      sample units, ties go to the later sample.
+
+    * validate_output() checks the values against merp -d.
+
+    * measure_native_many() measures the channels of a $ measure at once.
+
+    """
+    return measure_native_many([merp_cmds], measures)[0]
+
+
+def measure_native_many(merp_cmds_group, measures=NATIVE_CALIBRATED):
+    """measure_native() for a list of command 3-ples, the channels of a measure at once
 
     Parameters
     ----------
-    output : dict
-       as returned by format_output
-    fmt : str
-       'tsv' or 'yaml'
-    mcf : str
-       path to merp command file
+    merp_cmds_group : list of 3-ples of str
+       (file, baseline, measure) as parsed by parse_merpfile()
+    measures : collection of str (NATIVE_CALIBRATED)
+       measures to compute, see measure_native()
 
     Returns
     -------
-      rval, msg : 2-ple of int, str
-        rval 0 = success, positive = warning, negative = fail
-        msg = brief explanation
+    measurements : list of dict or None
+       in the order of merp_cmds_group, see measure_native()
+
+    Notes
+    -----
+
+    * commands that differ only in channel are regrouped by (ERP file,
+      bin, baseline, measure, window, arguments) and each group is
+      measured with one array operation on the bin's (channels,
+      points) waveforms, then the rows are put back in command order.
+
     """
-    merp2tbl_vals = []
-    if fmt == "yaml":
-        for out in yaml.load(output, Loader=yaml.SafeLoader):
-            if "value" in out.keys():
-                merp2tbl_vals.append(out["value"])
-            else:
-                msg = "yaml value key not found, cannot validate data"
-                return (1, msg)
+    return [
+        None if measurement is None else dict(measurement)
+        for measurement in _measure_native_many(merp_cmds_group, measures)
+    ]
 
-    elif fmt == "tsv":
-        out_lines = output.split("\n")
-        header = out_lines[0].split("\t")
-        value_idx = None
-        try:
-            value_idx = header.index("value")
-        except ValueError:
-            msg = "tsv value column not found, cannot validate data"
-            return (2, msg)
 
-        if value_idx is not None:
-            merp2tbl_vals = [
-                out_line.split("\t")[value_idx] for out_line in out_lines[1:]
-            ]
-            merp2tbl_vals = [v if v == "NA" else float(v) for v in merp2tbl_vals]
-    else:
-        raise ValueError("unknown format: ", fmt)
+def _measure_native_many(merp_cmds_group, measures):
+    """measure_native_many() as MerpRecords"""
+    plan = dict()
+    for i, merp_cmds in enumerate(merp_cmds_group):
+        key, chan_s = _channel_key(merp_cmds)
+        plan.setdefault(key, []).append((i, chan_s))
 
-    if merp2tbl_vals == []:
-        msg = "no merp2tbl values not found, cannot validate data"
-        return (1, msg)
+    measurements = [None] * len(merp_cmds_group)
+    for key, members in plan.items():
+        chans = [chan_s for _, chan_s in members]
+        records = _measure_native_channels(key, chans, measures)
+        for (i, _), record in zip(members, records):
+            measurements[i] = record
+    return measurements
 
-    # run merp -d and slurp values
-    proc_res = subprocess.run(
-        ["merp", "-d", mcf], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    )
 
-    merp_vals = [
-        float(v)
-        for v in proc_res.stdout.decode("utf-8").split("\n")
-        if len(v.strip()) > 0
+def _measure_native_channels(merp_cmds, chans, measures):
+    """MerpRecord or None for each channel string of a command 3-ple with channel $"""
+    measurements = [None] * len(chans)
+    _, baseline, cmd_str = merp_cmds
+    fields = cmd_str.split(" ")
+    meas = fields[0]
+    if meas not in measures or meas not in NATIVE_MEASURES or len(fields) < 6:
+        return measurements
+    bin_s, _, erpfile, start_s, stop_s = fields[1:6]
+    args = fields[6:]
+    if not all(s.isdigit() for s in (bin_s, start_s, stop_s)):
+        return measurements
+
+    try:
+        erp = open_erp(erpfile)
+    except (OSError, ValueError):
+        return measurements
+    bin_n = int(bin_s)
+    if not 0 < bin_n < erp.data.shape[0]:
+        return measurements
+    lo, hi = erp.index(float(start_s)), erp.index(float(stop_s))
+    if not 0 <= lo <= hi < ERP_NPOINTS:
+        return measurements
+    todo = [
+        i
+        for i, chan_s in enumerate(chans)
+        if chan_s.isdigit() and int(chan_s) < erp.data.shape[1]
     ]
+    if not todo:
+        return measurements
+
+    tic = _tic()
+    try:
+        waveforms = WAVEFORM_CACHE.get(erp, bin_n, baseline)
+        values = _native_values(
+            meas, erp, waveforms[[int(chans[i]) for i in todo]], lo, hi, args
+        )
+    except (ValueError, IndexError):
+        return measurements  # bad baseline or measure arguments, merp complains
+    _toc("native", tic)
+
+    meas_desc, units = NATIVE_MEASURES[meas]
+    bin_keys = ["epochs_d", "subject_s", "bin_desc_s", "condition_s", "expt_s"]
+    row = dict(zip(bin_keys, erp.bin_info(bin_n)))
+    row.update(
+        meas_desc_s=meas_desc,
+        units_s=units,
+        meas_label_s=meas,
+        bin_d=bin_s,
+        erpfile_s=erpfile,
+        win_start_f=start_s,
+        win_stop_f=stop_s,
+        meas_args_s=" ".join(args),
+    )
+    for i, (value, error) in zip(todo, values):
+        row.update(
+            chan_desc_s=erp.chan_descs[int(chans[i])],
+            chan_d=chans[i],
+            value_f=value,
+            merp_error_s=error,
+        )
+        values_i = [row[name] for name in LONG_MERP_PARSER.fields]
+        for j in LONG_MERP_PARSER.intern_idx:
+            values_i[j] = sys.intern(values_i[j])
+        measurements[i] = MerpRecord(LONG_MERP_PARSER.fields, values_i)
+    return measurements
 
-    # length mismatch
-    if len(merp_vals) != len(merp2tbl_vals):
-        msg = "merp2tbl " + mcf + "output value length mismatch"
-        return -1
 
-    # check value for value, skip NAs
-    for i, v in enumerate(merp2tbl_vals):
-        if v != "NA" and not merp_vals[i] == merp2tbl_vals[i]:
-            msg = "merp2tbl {0} output line {1}: {2} != merp -d {3}".format(
-                mcf, i, merp2tbl_vals[i], merp_vals[i]
-            )
-            return (-2, msg)
-    return (0, "")
+def _measure_native_batch(merp_cmds_group, mcf, measures=NATIVE_CALIBRATED):
+    """_measure_batch() with the native engine, the rest go to merp in one batch"""
+    measurements = _measure_native_logged(merp_cmds_group, mcf, measures)
+    todo = [i for i, measurement in enumerate(measurements) if measurement is None]
+    if todo:
+        merp_measurements = _measure_batch([merp_cmds_group[i] for i in todo], mcf)
+        for i, measurement in zip(todo, merp_measurements):
+            measurements[i] = measurement
+    return measurements
+
+
+def _measure_native_logged(merp_cmds_group, mcf, measures):
+    """measure_native_many() with the run columns logged, None for merp"""
+    measurements = _measure_native_many(merp_cmds_group, measures)
+    for i, merp_cmds in enumerate(merp_cmds_group):
+        if measurements[i] is not None:
+            measurements[i] = _log_measurement(measurements[i], merp_cmds, mcf)
+    return measurements
+
+
+class _Measured(list):
+    """measurements of a unit already made in-process, _iter_units() passes them on"""
+
+
+def _iter_native_units(indexed_cmds, mcf, measures=NATIVE_CALIBRATED):
+    """(indexes, commands or _Measured) units of an unbatched native run
+
+    Each measure line is measured in-process as it is reached, and the
+    commands left to merp are a unit each, so they spread over the jobs
+    like an engine="merp" run.
+    """
+    for idxs, merp_cmds_group in _group_expansions(indexed_cmds):
+        measurements = _measure_native_logged(merp_cmds_group, mcf, measures)
+        done = [i for i, m in enumerate(measurements) if m is not None]
+        if done:
+            yield [idxs[i] for i in done], _Measured(measurements[i] for i in done)
+        for i, measurement in enumerate(measurements):
+            if measurement is None:
+                yield [idxs[i]], [merp_cmds_group[i]]
+
+
+def _measure_native_unit(unit, mcf):
+    """measure function of _iter_native_units() units"""
+    if isinstance(unit, _Measured):
+        return unit
+    return [_measure(merp_cmds, mcf) for merp_cmds in unit]
 
 
 def main():
@@ -701,7 +3378,13 @@ def main():
     )
 
     # names
-    PARSER.add_argument("mcf", metavar="mcf", type=str, help="merp command file")
+    PARSER.add_argument(
+        "mcf",
+        metavar="mcf",
+        type=str,
+        nargs="+",
+        help="merp command file, or several files or glob patterns, e.g., 's*.mcf'",
+    )
 
     # collect optional column names to subset
     PARSER.add_argument(
@@ -719,8 +3402,9 @@ def main():
         metavar="format",
         dest="format",
         help=(
-            "'tsv' for tab-separated rows x columns or "
-            "'yaml' for YAML document output"
+            "'tsv' for tab-separated rows x columns, "
+            "'yaml' for YAML document output, "
+            "'parquet' or 'feather' for binary columnar output"
         ),
     )
 
@@ -735,6 +3419,14 @@ def main():
         ),
     )
 
+    # supplementary data tags
+    PARSER.add_argument(
+        "-no-lint",
+        action="store_false",
+        dest="lint",
+        help=("-no-lint skips the yamllint check of the -tagf file"),
+    )
+
     # supplementary data tags
     PARSER.add_argument(
         "-debug",
@@ -743,16 +3435,261 @@ def main():
         help=("-debug mode shows command file parse before running merp"),
     )
 
-    ARGS_DICT = vars(PARSER.parse_args())  # fetch from sys.argv
+    # one merp process per file and baseline
+    PARSER.add_argument(
+        "-batch",
+        action="store_true",
+        dest="batch",
+        help=(
+            "-batch mode runs all measures on the same file and baseline "
+            "through one merp process"
+        ),
+    )
+
+    # concurrent merp processes
+    PARSER.add_argument(
+        "-jobs",
+        type=int,
+        metavar="N",
+        dest="jobs",
+        default=1,
+        help=("run up to N merp processes at the same time, default 1"),
+    )
+
+    # in-process measurements
+    PARSER.add_argument(
+        "-engine",
+        type=str,
+        metavar="engine",
+        dest="engine",
+        default="merp",
+        choices=ENGINES,
+        help=(
+            "'merp' runs merp for every measurement (default), 'native' "
+            "computes {0} from the ERP files in-process and runs merp for the "
+            "rest, 'native-all' also computes {1}, not yet checked against "
+            "merp".format(
+                ", ".join(m for m in NATIVE_MEASURES if m in NATIVE_CALIBRATED),
+                ", ".join(m for m in NATIVE_MEASURES if m not in NATIVE_CALIBRATED),
+            )
+        ),
+    )
+
+    # ERP file digest sidecar
+    PARSER.add_argument(
+        "-md5store",
+        type=str,
+        metavar="md5store",
+        dest="md5store",
+        help=(
+            "md5store.json file of ERP file digests to reuse across runs, "
+            "created if it doesn't exist"
+        ),
+    )
+
+    # on-disk measurement cache
+    PARSER.add_argument(
+        "-cache",
+        type=str,
+        nargs="?",
+        const=default_cache_dir(),
+        metavar="cache_dir",
+        dest="cache",
+        help=(
+            "reuse measurements of unchanged ERP files and -tagf yamllint "
+            "checks from an on-disk cache, "
+            "default cache_dir {0}".format(default_cache_dir())
+        ),
+    )
+    PARSER.add_argument(
+        "-no-cache",
+        action="store_const",
+        const=None,
+        dest="cache",
+        help=("-no-cache runs every measurement through merp, the default"),
+    )
+
+    # rerun only what changed since the last run
+    PARSER.add_argument(
+        "-incremental",
+        type=str,
+        metavar="manifest",
+        dest="incremental",
+        help=(
+            "manifest.json of the previous run's rows, only commands with a "
+            "changed ERP file, baseline or measure are rerun, created if it "
+            "doesn't exist"
+        ),
+    )
+
+    # YAML anchors for repeated metadata
+    PARSER.add_argument(
+        "-anchors",
+        action="store_true",
+        dest="anchors",
+        help=(
+            "-anchors writes repeated -format yaml metadata, e.g., subject, "
+            "once as a YAML anchor and refers back to it with aliases"
+        ),
+    )
 
-    RESULT = run_merp(ARGS_DICT["mcf"], ARGS_DICT["debug"])
+    # merp -d cross check
+    PARSER.add_argument(
+        "-validate",
+        type=str,
+        metavar="mode",
+        dest="validate",
+        default="full",
+        choices=VALIDATE_MODES,
+        help=(
+            "check output values against merp -d: 'full' reruns the whole "
+            "command file (default), 'sample' reruns {0} random measurements, "
+            "'off' skips the check. The check runs after the rows are "
+            "written, on stdout they are out before a failure, -outdir files "
+            "are only kept if they pass".format(VALIDATE_SAMPLE_K)
+        ),
+    )
+
+    # one output file per command file
+    PARSER.add_argument(
+        "-outdir",
+        type=str,
+        metavar="outdir",
+        dest="outdir",
+        help=(
+            "write each command file's output to outdir/mcf_name.format "
+            "instead of one table for all to stdout"
+        ),
+    )
 
-    # validation built into formatter
-    FORMATTED = format_output(
-        RESULT,
-        ARGS_DICT["mcf"],
-        fmt=ARGS_DICT["format"],
-        out_keys=ARGS_DICT["columns"],
-        tag_file=ARGS_DICT["tagf"],
+    # per-stage timing
+    PARSER.add_argument(
+        "-profile",
+        type=str,
+        nargs="?",
+        const="",
+        metavar="report.json",
+        dest="profile",
+        help=(
+            "-profile prints time, calls and bytes for each stage of the run "
+            "to stderr, and writes them to report.json if given"
+        ),
     )
-    print(FORMATTED)
+
+    ARGS_DICT = vars(PARSER.parse_args())  # fetch from sys.argv
+
+    if ARGS_DICT["profile"] is None:
+        _main(ARGS_DICT, PARSER)
+        return
+
+    with Profiler() as prof:
+        _main(ARGS_DICT, PARSER)
+    sys.stderr.write(prof.summary())
+    if ARGS_DICT["profile"]:
+        prof.write_json(ARGS_DICT["profile"])
+
+
+def _main(ARGS_DICT, PARSER):
+    """main() once the arguments are parsed"""
+
+    if ARGS_DICT["incremental"] is not None:
+        if ARGS_DICT["cache"] is not None:
+            PARSER.error("use -cache or -incremental, not both")
+        ARGS_DICT["cache"] = RunManifest(ARGS_DICT["incremental"])
+
+    MCFS = expand_merpfiles(ARGS_DICT["mcf"])
+    MERP_CMDS = [parse_merpfile(mcf) for mcf in MCFS]  # once for the run and checks
+    FMT = ARGS_DICT["format"] or "tsv"
+    TAGF = ARGS_DICT["tagf"]
+    LINT_CACHE = ARGS_DICT["cache"] if isinstance(ARGS_DICT["cache"], str) else None
+    if TAGF is not None and (
+        ARGS_DICT["outdir"] or not ARGS_DICT["lint"] or LINT_CACHE is not None
+    ):
+        # once for all outputs
+        TAGF = load_tagfile(TAGF, lint=ARGS_DICT["lint"], cache=LINT_CACHE)
+
+    if ARGS_DICT["outdir"] is None:
+        # stream rows as merp returns them, validation built into writer
+        RESULT = _iter_merp_files_records(
+            zip(MCFS, MERP_CMDS),
+            ARGS_DICT["debug"],
+            ARGS_DICT["batch"],
+            ARGS_DICT["jobs"],
+            ARGS_DICT["md5store"],
+            ARGS_DICT["cache"],
+            ARGS_DICT["engine"],
+        )
+        write_output(
+            RESULT,
+            MCFS[0] if len(MCFS) == 1 else MCFS,
+            sys.stdout,
+            fmt=FMT,
+            out_keys=ARGS_DICT["columns"],
+            tag_file=TAGF,
+            validate=ARGS_DICT["validate"],
+            n_results=sum(len(merp_cmds) for merp_cmds in MERP_CMDS),
+            anchors=ARGS_DICT["anchors"],
+            merp_cmds=MERP_CMDS[0] if len(MCFS) == 1 else MERP_CMDS,
+        )
+        _close_manifest(ARGS_DICT)
+        return
+
+    # same digests, cache and merp workers for every file
+    os.makedirs(ARGS_DICT["outdir"], exist_ok=True)
+    with _run_context(ARGS_DICT["jobs"], ARGS_DICT["md5store"], ARGS_DICT["cache"]) as (
+        POOL,
+        CACHE,
+    ):
+        for mcf, merp_cmds in zip(MCFS, MERP_CMDS):
+            RESULT = _iter_merp_records(
+                mcf,
+                merp_cmds,
+                ARGS_DICT["debug"],
+                ARGS_DICT["batch"],
+                ARGS_DICT["jobs"],
+                None,
+                CACHE,
+                POOL,
+                ARGS_DICT["engine"],
+            )
+            out_f = os.path.join(
+                ARGS_DICT["outdir"],
+                os.path.splitext(os.path.basename(mcf))[0] + "." + FMT,
+            )
+            # in place only once validated, a failed run leaves no table
+            part_f = "{0}.{1}.part".format(out_f, os.getpid())
+            mode = "wb" if FMT in COLUMNAR_FORMATS else "w"
+            try:
+                with open(part_f, mode) as stream:
+                    write_output(
+                        RESULT,
+                        mcf,
+                        stream,
+                        fmt=FMT,
+                        out_keys=ARGS_DICT["columns"],
+                        tag_file=TAGF,
+                        validate=ARGS_DICT["validate"],
+                        n_results=len(merp_cmds),
+                        anchors=ARGS_DICT["anchors"],
+                        merp_cmds=merp_cmds,
+                    )
+                os.replace(part_f, out_f)
+            finally:
+                if os.path.exists(part_f):
+                    os.remove(part_f)
+    _close_manifest(ARGS_DICT)
+
+
+def _close_manifest(args_dict):
+    """write the -incremental manifest once the output is done"""
+    manifest = args_dict["cache"]
+    if not isinstance(manifest, RunManifest):
+        return
+    manifest.close()
+    if args_dict["debug"]:
+        print(
+            "incremental {0}: {1} reused, {2} measured".format(
+                manifest.path, manifest.hits, manifest.misses
+            ),
+            file=sys.stderr,
+        )
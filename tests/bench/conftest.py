@@ -0,0 +1,69 @@
+"""fixtures for the merp2tbl benchmarks: a fake merp and synthetic command files"""
+
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+BENCH_DIR = Path(__file__).resolve().parent
+TEST_DATA = BENCH_DIR.parent / "data"
+
+# scale factor for the synthetic command files, e.g., MERP2TBL_BENCH_SCALE=10
+BENCH_SCALE = int(os.environ.get("MERP2TBL_BENCH_SCALE", 1))
+
+# measure commands the fake merp knows, cycled through by make_mcf
+MEASURES = [
+    "meana 1 $ * 200 400",
+    "pkl 1 $ * 250 800 +",
+    "lpka 1 $ * 250 800 + 3",
+    "fal 1 $ * 0 600 0.5",
+    "rms 1 $ * 100 500",
+    "centroid 1 $ * 300 500",
+    "slope 1 $ * 200 300",
+]
+
+
+@pytest.fixture
+def fake_merp(tmp_path, monkeypatch):
+    """put the stub merp first on $PATH
+
+    FAKE_MERP_LATENCY (seconds per merp run) passes through from the
+    environment to emulate a slow merp, default 0.
+    """
+    monkeypatch.setenv("PATH", str(BENCH_DIR / "bin") + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("FAKE_MERP_LATENCY", os.environ.get("FAKE_MERP_LATENCY", "0"))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    assert shutil.which("merp") == str(BENCH_DIR / "bin" / "merp")
+
+
+@pytest.fixture
+def make_mcf(tmp_path, monkeypatch):
+    """factory for synthetic command files, channels x files x measures measurements
+
+    make_mcf(n_files, n_chans, n_measures, baselines=1) writes
+    n_files copies of calstest.x.avg and a command file with one
+    channels line, n_measures wildcard measures per baseline, and
+    returns the command file name. The run happens in tmp_path.
+    """
+    monkeypatch.chdir(tmp_path)
+
+    def _make_mcf(n_files, n_chans, n_measures, baselines=1):
+        mcf = "bench_{0}x{1}x{2}x{3}.mcf".format(
+            n_files, n_chans, n_measures, baselines
+        )
+        lines = []
+        for i in range(n_files):
+            erpfile = "erp{0:04d}.avg".format(i)
+            if not os.path.exists(erpfile):
+                shutil.copy(str(TEST_DATA / "calstest.x.avg"), erpfile)
+            lines.append("file {0}".format(erpfile))
+        lines.append("channels " + " ".join(str(c % 32) for c in range(n_chans)))
+        for b in range(baselines):
+            lines.append("baseline -100 {0}".format(-b * 10))
+            lines += [MEASURES[m % len(MEASURES)] for m in range(n_measures)]
+        with open(mcf, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return mcf
+
+    return _make_mcf
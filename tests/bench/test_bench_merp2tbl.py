@@ -0,0 +1,87 @@
+"""merp2tbl throughput benchmarks with the fake merp in tests/bench/bin
+
+Run with pytest-benchmark, e.g.,
+
+    pytest tests/bench --benchmark-only
+    MERP2TBL_BENCH_SCALE=10 FAKE_MERP_LATENCY=0.02 pytest tests/bench --benchmark-only
+
+MERP2TBL_BENCH_SCALE multiplies the number of ERP files in the synthetic
+command files, FAKE_MERP_LATENCY adds seconds of startup to each merp run.
+"""
+
+import subprocess
+
+import pytest
+
+import merp2tbl.merp2tbl as merp2tbl
+
+from .conftest import BENCH_SCALE
+
+pytest.importorskip("pytest_benchmark")
+pytestmark = pytest.mark.usefixtures("fake_merp")
+
+# (files, channels, measures) for quick runs through merp and big
+# command files for the in-process stages
+SMALL = (2 * BENCH_SCALE, 8, 2)
+LARGE = (8 * BENCH_SCALE, 32, 7)
+
+
+def _n_measures(n_files, n_chans, n_measures, baselines=1):
+    return n_files * n_chans * n_measures * baselines
+
+
+def test_bench_parse_merpfile(benchmark, make_mcf):
+    mcf = make_mcf(*LARGE, baselines=4)
+    merp_cmds = benchmark(merp2tbl.parse_merpfile, mcf)
+    assert len(merp_cmds) == _n_measures(*LARGE, baselines=4)
+
+
+def test_bench_parse_long_merp_output(benchmark, make_mcf):
+    mcf = make_mcf(*LARGE)
+    stdout = subprocess.run(["merp", mcf], stdout=subprocess.PIPE, check=True).stdout
+    outputs = [(chunk, b"") for chunk in merp2tbl._split_long_merp_output(stdout)]
+    rows = benchmark(merp2tbl.LONG_MERP_PARSER.parse_many, outputs)
+    assert len(rows) == _n_measures(*LARGE)
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        dict(),
+        dict(batch=True),
+        dict(jobs=4),
+        dict(batch=True, jobs=4),
+        dict(engine="native"),
+    ],
+    ids=["serial", "batch", "jobs4", "batch_jobs4", "native"],
+)
+def test_bench_run_merp(benchmark, make_mcf, kwargs):
+    mcf = make_mcf(*SMALL)
+    results = benchmark.pedantic(
+        merp2tbl.run_merp, args=(mcf,), kwargs=kwargs, rounds=3
+    )
+    assert len(results) == _n_measures(*SMALL)
+
+
+@pytest.mark.parametrize("fmt", ["tsv", "yaml", "parquet"])
+def test_bench_format_output(benchmark, make_mcf, fmt):
+    if fmt in merp2tbl.COLUMNAR_FORMATS:
+        pytest.importorskip("pyarrow")
+    mcf = make_mcf(*LARGE)
+    results = merp2tbl.run_merp(mcf, batch=True)
+    output = benchmark(merp2tbl.format_output, results, mcf, fmt=fmt, validate="off")
+    assert len(output) > 0
+
+
+@pytest.mark.parametrize("mode", ["full", "sample"])
+def test_bench_validate_output(benchmark, make_mcf, mode):
+    mcf = make_mcf(*LARGE)
+    results = merp2tbl.run_merp(mcf, batch=True)
+    output = merp2tbl.format_output(results, mcf, validate="off")
+    checked = benchmark.pedantic(
+        merp2tbl.validate_output,
+        args=(output, "tsv", mcf),
+        kwargs=dict(mode=mode, seed=0),
+        rounds=3,
+    )
+    assert checked == (0, "")
@@ -1,13 +1,23 @@
 #!/usr/bin/env python
 """merp2tbl tests"""
 
+import asyncio
 import subprocess
 import os
 import os.path
+import random
 import re
+import shutil
+import threading
 from pathlib import Path
 import hashlib
+import io
+import json
+import numpy as np
 import pandas as pd
+import sys
+import yaml
+import yamllint.linter
 import pytest
 
 import merp2tbl.merp2tbl as merp2tbl
@@ -16,6 +26,21 @@ IS_CI = "GITHUB_ACTION" in os.environ.keys()
 
 skip_ci = pytest.mark.skipif(IS_CI, reason="requires 32-bit binary")
 
+
+def _stub_merp():
+    """True if the merp on $PATH is the tests/bench stand-in"""
+    merp = shutil.which("merp")
+    if merp is None:
+        return False
+    with open(merp, "rb") as f:
+        return b"stand-in for the ERPSS merp" in f.read(4096)
+
+
+# compares against real merp values, the stand-in's are fake
+skip_stub_merp = pytest.mark.skipif(
+    IS_CI or _stub_merp(), reason="requires the real merp binary"
+)
+
 p = Path(".")
 os.chdir(p / "tests" / "data")
 good_mcfs = [str(x) for x in p.glob("*good*.mcf")]
@@ -50,6 +75,13 @@ DAT_MD5 = {
     "typical_good.dat": "9297c1fc74d19a922aa868f93b4101e3",
 }
 
+
+# keep lint and result caches out of the user's home
+@pytest.fixture(autouse=True)
+def user_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+
 # ------------------------------------------------------------
 # set up
 @skip_ci
@@ -96,6 +128,66 @@ def test_smoke_parse_merpfile():
             merp2tbl.parse_merpfile(mcf)
 
 
+def test_parse_merpfile_expansion(tmp_path):
+    """lazy $ x * expansion in merp order, sized and indexable"""
+    mcf = tmp_path / "fanout.mcf"
+    mcf.write_text(
+        "# comment\n"
+        "file a.avg\n"
+        "file b.avg   # trailing comment\n"
+        "channels 3 4 5\n\n"
+        "meana 1 $ * 200 400\n"
+        "baseline -100 0\n"
+        "file c.avg\n"
+        "fal 1 7 * 250 400 + .5\n"
+        "pks 1 $ c.avg 250 800\n"
+    )
+    merp_cmds = merp2tbl.parse_merpfile(str(mcf))
+    expected = (
+        [
+            ("file " + f, "default", "meana 1 {0} {1} 200 400".format(c, f))
+            for c in (3, 4, 5)
+            for f in ("a.avg", "b.avg")
+        ]
+        + [
+            ("file " + f, "baseline -100 0", "fal 1 7 {0} 250 400 + .5".format(f))
+            for f in ("a.avg", "b.avg", "c.avg")
+        ]
+        + [
+            ("file c.avg", "baseline -100 0", "pks 1 {0} c.avg 250 800".format(c))
+            for c in (3, 4, 5)
+        ]
+    )
+    assert len(merp_cmds) == len(expected)
+    assert list(merp_cmds) == expected
+    assert [merp_cmds[i] for i in range(-len(expected), len(expected))] == expected * 2
+    assert merp_cmds[2:8:3] == expected[2:8:3]
+    assert merp_cmds == expected
+
+    # measure lines are stored once, not expanded
+    mcf.write_text(
+        "".join("file f{0}.avg\n".format(i) for i in range(1000))
+        + "channels "
+        + " ".join(str(c) for c in range(32))
+        + "\n"
+        + "meana 1 $ * 200 400\n" * 100
+    )
+    merp_cmds = merp2tbl.parse_merpfile(str(mcf))
+    assert len(merp_cmds) == 100 * 32 * 1000
+    assert len(merp_cmds._lines) == 100
+    assert merp_cmds[-1] == ("file f999.avg", "default", "meana 1 31 f999.avg 200 400")
+
+
+@pytest.mark.parametrize(
+    "line", ["channels 1 x", "channels 65", "file", "meana 1 $ *", "meana x $ * 1 2"]
+)
+def test_parse_merpfile_bad_line(tmp_path, line):
+    mcf = tmp_path / "bad.mcf"
+    mcf.write_text("file a.avg\nchannels 1\n" + line + "\n")
+    with pytest.raises(ValueError):
+        merp2tbl.parse_merpfile(str(mcf))
+
+
 def test_table_dat():
     """check the locally generated files haven't changed"""
     for mcf in good_mcfs + softerror_mcfs:
@@ -188,3 +280,1075 @@ def test_select_columns():
                 print("# " + "-" * 40)
                 merp2tbl.format_output(result, mcf, fmt=fmt, out_keys=cols)
                 print()
+
+
+@skip_ci
+def test_run_merp_batch():
+    """batched merp runs match one merp per measure"""
+    for mcf in good_mcfs + softerror_mcfs:
+        assert merp2tbl.run_merp(mcf, batch=True) == merp2tbl.run_merp(mcf)
+
+
+@skip_ci
+def test_run_merp_jobs():
+    """concurrent merp runs keep canonical order"""
+    for mcf in good_mcfs + softerror_mcfs:
+        expected = merp2tbl.run_merp(mcf)
+        assert merp2tbl.run_merp(mcf, jobs=4) == expected
+        assert merp2tbl.run_merp(mcf, batch=True, jobs=4) == expected
+
+
+@pytest.mark.parametrize("jobs", [0, -1, 1.5])
+def test_run_merp_bad_jobs(jobs):
+    with pytest.raises(ValueError):
+        merp2tbl.run_merp(good_mcfs[0], jobs=jobs)
+
+
+def test_merp_spawns(monkeypatch):
+    """one merp process per measure, or per file and baseline batched, nothing else"""
+    bench_bin = (Path("..") / "bench" / "bin").resolve()
+    monkeypatch.setenv("PATH", str(bench_bin) + os.pathsep + os.environ["PATH"])
+    spawned = []
+
+    class CountingPopen(subprocess.Popen):
+        def __init__(self, args, *more_args, **kwargs):
+            spawned.append(args[0])
+            super().__init__(args, *more_args, **kwargs)
+
+    monkeypatch.setattr(subprocess, "Popen", CountingPopen)
+    mcf = "typical_good.mcf"
+    merp_cmds_list = merp2tbl.parse_merpfile(mcf)
+    assert len(merp2tbl.run_merp(mcf)) == len(merp_cmds_list)
+    assert spawned == ["merp"] * len(merp_cmds_list)
+
+    spawned.clear()
+    merp2tbl.run_merp(mcf, batch=True)
+    n_groups = len(merp2tbl._group_merp_cmds(enumerate(merp_cmds_list)))
+    assert spawned == ["merp"] * n_groups
+
+
+@skip_ci
+def test_run_merp_async(monkeypatch):
+    """asyncio runs match run_merp and validate"""
+    for mcf in good_mcfs + softerror_mcfs:
+        expected = merp2tbl.run_merp(mcf)
+        for batch, concurrency in [(False, 1), (False, 4), (True, 4)]:
+            measurements = asyncio.run(
+                merp2tbl.run_merp_async(mcf, batch=batch, concurrency=concurrency)
+            )
+            assert measurements == expected
+
+    # ERP files are hashed off the event loop thread
+    hashed_in = []
+    erp_md5 = merp2tbl.erp_md5
+
+    def spy(erpfile):
+        hashed_in.append(threading.current_thread())
+        return erp_md5(erpfile)
+
+    monkeypatch.setattr(merp2tbl, "erp_md5", spy)
+    for batch in (False, True):
+        asyncio.run(merp2tbl.run_merp_async(good_mcfs[0], batch=batch))
+    assert hashed_in and threading.main_thread() not in hashed_in
+
+    mcf = "typical_good.mcf"
+    output = merp2tbl.format_output(merp2tbl.run_merp(mcf), mcf, validate="off")
+    for mode in ["full", "sample"]:
+        assert asyncio.run(
+            merp2tbl.validate_output_async(output, "tsv", mcf, mode=mode)
+        ) == merp2tbl.validate_output(output, "tsv", mcf, mode=mode)
+
+    # sample validation parses the command file off the loop too
+    parsed_in = []
+    parse_merpfile = merp2tbl.parse_merpfile
+
+    def parse_spy(mcf):
+        parsed_in.append(threading.current_thread())
+        return parse_merpfile(mcf)
+
+    monkeypatch.setattr(merp2tbl, "parse_merpfile", parse_spy)
+    assert asyncio.run(
+        merp2tbl.validate_output_async(output, "tsv", mcf, mode="sample")
+    ) == (0, "")
+    assert parsed_in and threading.main_thread() not in parsed_in
+
+
+@pytest.mark.parametrize("concurrency", [0, 1.5])
+def test_run_merp_async_bad_concurrency(concurrency):
+    with pytest.raises(ValueError):
+        asyncio.run(merp2tbl.run_merp_async(good_mcfs[0], concurrency=concurrency))
+
+
+def test_merp_async_cancel(monkeypatch):
+    """cancelling the awaiting task kills the subprocess"""
+    procs = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def spy(*args, **kwargs):
+        procs.append(await create_subprocess_exec(*args, **kwargs))
+        return procs[-1]
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", spy)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(merp2tbl._merp_async(["sleep", "10"], None), 0.2))
+    assert len(procs) == 1 and procs[0].returncode is not None
+
+
+ERP_MD5 = {
+    "calstest.x.avg": "421207f4a07e71ec166e166cbb76924a",
+    "calstest.x.nrm": "918cdbe89ac5b45b5dd833d99b3a114c",
+}
+
+
+def test_erp_md5(monkeypatch):
+    """streamed digests match, repeats come from the cache"""
+    for erpfile, md5 in ERP_MD5.items():
+        assert merp2tbl.erp_md5(erpfile) == md5
+
+    monkeypatch.setattr(merp2tbl.hashlib, "md5", None)  # any rehash fails
+    for erpfile, md5 in ERP_MD5.items():
+        assert merp2tbl.erp_md5(erpfile) == md5
+
+
+def test_erp_md5_unlocked(monkeypatch):
+    """other threads can look up digests while a file is hashed"""
+    monkeypatch.setattr(merp2tbl, "_MD5_CACHE", dict())
+    md5 = hashlib.md5
+    locked = []
+
+    def spy(*args):
+        locked.append(merp2tbl._MD5_CACHE_LOCK.locked())
+        return md5(*args)
+
+    monkeypatch.setattr(merp2tbl.hashlib, "md5", spy)
+    for erpfile, md5_hex in ERP_MD5.items():
+        assert merp2tbl.erp_md5(erpfile) == md5_hex
+    assert locked == [False] * len(ERP_MD5)
+
+
+def test_md5_store(tmp_path, monkeypatch):
+    """sidecar digests survive a fresh process cache"""
+    md5_store = str(tmp_path / "md5store.json")
+    for erpfile in ERP_MD5.keys():
+        merp2tbl.erp_md5(erpfile)
+    merp2tbl.save_md5_store(md5_store)
+
+    monkeypatch.setattr(merp2tbl, "_MD5_CACHE", dict())
+    monkeypatch.setattr(merp2tbl.hashlib, "md5", None)
+    merp2tbl.load_md5_store(md5_store)
+    for erpfile, md5 in ERP_MD5.items():
+        assert merp2tbl.erp_md5(erpfile) == md5
+
+
+def test_result_cache(tmp_path):
+    """cache round trip, LRU and age eviction"""
+    cache = merp2tbl.ResultCache(str(tmp_path))
+    merp_cmds_list = merp2tbl.parse_merpfile("typical_good.mcf")
+    keys = [merp2tbl.ResultCache.key(cmds, "v0") for cmds in merp_cmds_list]
+    assert keys[0][0] == ERP_MD5["calstest.x.avg"]
+    for i, key in enumerate(keys):
+        assert cache.get(key) is None
+        cache.put(key, {"value_f": str(i), "baseline_s": "default"})
+    assert cache.get(keys[3]) == {"value_f": "3"}
+    assert cache.get(keys[3][:3] + ("v1",)) is None  # new merp binary
+    cache.close()
+
+    # reopen, shrink to about half, most recently used survive
+    cache = merp2tbl.ResultCache(str(tmp_path), max_bytes=200)
+    cache.get(keys[0])
+    cache.evict()
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    cache.max_age = -1
+    cache.evict()
+    assert cache.get(keys[0]) is None
+    cache.close()
+
+
+def test_result_cache_concurrent(tmp_path):
+    """runs in two processes share one cache without locking each other out"""
+    run = (
+        "import sys, time\n"
+        "import merp2tbl.merp2tbl as merp2tbl\n"
+        "merp2tbl.CACHE_TIMEOUT = 1\n"
+        "cache = merp2tbl.ResultCache(sys.argv[1])\n"
+        "for _ in range(2):\n"
+        "    for _ in merp2tbl.iter_merp(sys.argv[2], cache=cache, engine='native'):\n"
+        "        time.sleep(0.05)\n"
+        "cache.close()\n"
+        "print(cache.hits, cache.misses)\n"
+    )
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(os.path.join("..", "..")))
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-c", run, str(tmp_path), "typical_good.mcf"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+        )
+        for _ in range(2)
+    ]
+    for proc in procs:
+        stdout, stderr = proc.communicate(timeout=60)
+        assert proc.returncode == 0, stderr.decode("utf-8")
+        hits, _ = stdout.split()
+        assert int(hits) >= 24
+
+
+def test_run_merp_cache_evicted(tmp_path, monkeypatch):
+    """rows evicted by another run between lookup and hand-off are measured again"""
+    mcf = "typical_good.mcf"
+    expected = merp2tbl.run_merp(mcf, batch=True, engine="native")
+
+    # unbatched native fallbacks go to merp, measure them natively here
+    monkeypatch.setattr(
+        merp2tbl,
+        "_measure",
+        lambda merp_cmds, mcf: merp2tbl._measure_native_batch([merp_cmds], mcf)[0],
+    )
+    for batch in (False, True):
+        cache = merp2tbl.ResultCache(str(tmp_path / str(batch)))
+        merp2tbl.run_merp(mcf, batch=batch, cache=cache, engine="native")
+        contains = cache.contains
+
+        def evicting_contains(key):
+            found = contains(key)
+            cache._db.execute(
+                "DELETE FROM results WHERE erp_md5=? AND baseline=? AND measure=?"
+                " AND merp_version=?",
+                key,
+            )
+            return found
+
+        monkeypatch.setattr(cache, "contains", evicting_contains)
+        hits = cache.hits
+        measurements = merp2tbl.run_merp(mcf, batch=batch, cache=cache, engine="native")
+        assert measurements == expected
+        assert cache.hits == hits
+        cache.close()
+
+
+@skip_ci
+def test_run_merp_cache(tmp_path):
+    """cached measurements match merp"""
+    for mcf in good_mcfs + softerror_mcfs:
+        expected = merp2tbl.run_merp(mcf)
+        for _ in range(2):
+            assert merp2tbl.run_merp(mcf, cache=str(tmp_path)) == expected
+
+
+# one measurement of long form merp output, cf. typical_good.tsv
+LONG_MERP_OUT = (
+    "Channel LDCeLDCe  Sum of 9\n"
+    + "{0:<41}{1:<40}{2:<41}{3:<40}{4}\n".format(
+        "calstest template",
+        "bin 1 cc/cal 1 item 1",
+        "experimental items",
+        "event coded cal pulses",
+        "lpkl 1 17 calstest.x.avg 250 800 + 3",
+    )
+    + "local peak latency 632 milliseconds\n"
+).encode("utf-8")
+
+LONG_MERP_ROW = {
+    "chan_desc_s": "LDCe",
+    "epochs_d": "9",
+    "subject_s": "calstest template",
+    "bin_desc_s": "bin 1 cc/cal 1 item 1",
+    "condition_s": "experimental items",
+    "expt_s": "event coded cal pulses",
+    "meas_desc_s": "local peak latency",
+    "value_f": "632",
+    "units_s": "milliseconds",
+    "meas_label_s": "lpkl",
+    "bin_d": "1",
+    "chan_d": "17",
+    "erpfile_s": "calstest.x.avg",
+    "win_start_f": "250",
+    "win_stop_f": "800",
+    "meas_args_s": "+ 3",
+    "merp_error_s": "NA",
+}
+
+
+def test_parse_long_merp_output():
+    row = merp2tbl.parse_long_merp_output(LONG_MERP_OUT, b"")
+    assert row == LONG_MERP_ROW
+    assert list(row.keys()) == list(LONG_MERP_ROW.keys())
+
+    # plain dicts serialize like they always did
+    assert type(row) is dict
+    assert json.loads(json.dumps(row)) == row
+    assert yaml.safe_load(yaml.safe_dump(row)) == row
+
+    # soft error, first line of stderr squeezed
+    row = merp2tbl.parse_long_merp_output(
+        LONG_MERP_OUT, b"lpk -  no local maximum.\nmore\n"
+    )
+    assert row["value_f"] == "NA"
+    assert row["merp_error_s"] == "lpk - no local maximum."
+
+
+def test_long_merp_parser_parse_many():
+    rows = merp2tbl.LONG_MERP_PARSER.parse_many([(LONG_MERP_OUT, b"")] * 3)
+    assert rows == [LONG_MERP_ROW] * 3
+    assert rows[0] is not rows[1]
+
+    # repeated metadata is one string, not one per row
+    for key in ["subject_s", "bin_desc_s", "erpfile_s", "units_s"]:
+        assert rows[0][key] is rows[1][key] is rows[2][key]
+
+
+def test_validate_output_modes():
+    """off skips merp, unknown modes fail"""
+    output = "value\n1.0\nNA"
+    assert merp2tbl.validate_output(output, "tsv", MIN_GOOD_MCF, mode="off") == (0, "")
+    with pytest.raises(ValueError):
+        merp2tbl.validate_output(output, "tsv", MIN_GOOD_MCF, mode="most")
+    with pytest.raises(ValueError):
+        asyncio.run(
+            merp2tbl.validate_output_async(output, "tsv", MIN_GOOD_MCF, mode="most")
+        )
+    with pytest.raises(ValueError):
+        merp2tbl.write_output([], MIN_GOOD_MCF, io.StringIO(), validate="most")
+
+
+@skip_ci
+def test_validate_output_sample(monkeypatch):
+    """sampled merp -d checks pass on good output, catch bad values"""
+    for mcf in good_mcfs + softerror_mcfs:
+        result = merp2tbl.run_merp(mcf)
+        output = merp2tbl.format_output(result, mcf, validate="off")
+        assert merp2tbl.validate_output(output, "tsv", mcf, mode="sample", k=3) == (
+            0,
+            "",
+        )
+
+        # corrupt the first good value
+        header, *rows = output.split("\n")
+        value_idx = header.split("\t").index("value")
+        for i, row in enumerate(rows):
+            cells = row.split("\t")
+            if cells[value_idx] != "NA":
+                cells[value_idx] = str(float(cells[value_idx]) + 1000)
+                rows[i] = "\t".join(cells)
+                break
+        output = "\n".join([header] + rows)
+        rval, _ = merp2tbl.validate_output(
+            output, "tsv", mcf, mode="sample", k=len(rows)
+        )
+        assert rval == -2
+
+    # write_output() samples from the command file the caller parsed
+    mcf = "typical_good.mcf"
+    result, merp_cmds = merp2tbl.run_merp(mcf), merp2tbl.parse_merpfile(mcf)
+    monkeypatch.setattr(merp2tbl, "parse_merpfile", None)
+    merp2tbl.write_output(
+        result, mcf, io.StringIO(), validate="sample", merp_cmds=merp_cmds
+    )
+
+
+def _long_merp_rows(n):
+    """n parsed measurements without running merp"""
+    rows = []
+    for i in range(n):
+        row = merp2tbl.parse_long_merp_output(LONG_MERP_OUT, b"")
+        row.update(
+            {
+                "value_f": str(600 + 4 * i),
+                "erp_md5_s": ERP_MD5["calstest.x.avg"],
+                "baseline_s": "default",
+                "merpfile_s": "typical_good.mcf",
+            }
+        )
+        rows.append(row)
+    return rows
+
+
+@pytest.mark.parametrize("fmt", ["tsv", "yaml"])
+def test_write_output_stream(fmt):
+    """streamed output is the same as the formatted output"""
+    results = _long_merp_rows(24)
+    for out_keys in [None, ["value", "chan", "wide_row_tag"]]:
+        for tag_file in [None, "test_typical_good.yml"]:
+            if tag_file is None and out_keys is not None:
+                continue
+            expected = merp2tbl.format_output(
+                results,
+                "typical_good.mcf",
+                fmt=fmt,
+                out_keys=out_keys,
+                tag_file=tag_file,
+                validate="off",
+            )
+            stream = io.StringIO()
+            merp2tbl.write_output(
+                (r for r in results),
+                "typical_good.mcf",
+                stream,
+                fmt=fmt,
+                out_keys=out_keys,
+                tag_file=tag_file,
+                validate="off",
+            )
+            assert stream.getvalue() == expected + "\n"
+
+    # same as dumping the whole document at once
+    if fmt == "yaml":
+        expected = merp2tbl.format_output(
+            results, "typical_good.mcf", fmt=fmt, validate="off"
+        )
+        rows = [dict(row) for row in merp2tbl.iter_rows(results)]
+        assert expected == "# generated by merp2tbl\n" + yaml.dump(
+            rows, explicit_start=True, default_flow_style=False
+        )
+
+
+def test_iter_rows_bad_tags():
+    """positional tags must match the number of measurements"""
+    with pytest.raises(ValueError):
+        list(merp2tbl.iter_rows(_long_merp_rows(23), "test_typical_good.yml"))
+    with pytest.raises(ValueError):
+        list(merp2tbl.iter_rows(_long_merp_rows(25), "test_typical_good.yml"))
+    with pytest.raises(ValueError):
+        merp2tbl.iter_rows(_long_merp_rows(23), "test_typical_good.yml", 23)
+
+    # empty tag lists, streamed with or without the count
+    for n_results in (None, 23):
+        with pytest.raises(ValueError):
+            list(merp2tbl.iter_rows(_long_merp_rows(23), {"t": []}, n_results))
+
+
+def test_to_columns():
+    """suffix typed columns, NA to NaN or None"""
+    results = _long_merp_rows(24)
+    results[1]["value_f"] = "NA"
+    results[2]["merp_error_s"] = "lpk - no local maximum."
+    columns = merp2tbl.to_columns(results, tag_file="test_typical_good.yml")
+    assert list(columns.keys()) == sorted(columns.keys())
+    assert columns["value"].dtype == "float64"
+    assert pd.isna(columns["value"][1]) and columns["value"][2] == 608.0
+    assert columns["chan"].dtype == "int64"
+    assert list(columns["merp_error"][1:3]) == [None, "lpk - no local maximum."]
+    assert columns["wide_row_tag"][23] == "tagX"
+    assert columns["experimenter_id"][0] == 17
+
+    df = merp2tbl.to_columns(results, out_keys=["chan", "subject", "value"], frame=True)
+    assert list(df.columns) == ["chan", "subject", "value"]
+    assert str(df["chan"].dtype) == "Int64"
+    assert str(df["subject"].dtype) == "category"
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "feather"])
+def test_format_output_columnar(fmt, monkeypatch):
+    """columnar round trip across several record batches"""
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.feather
+    import pyarrow.parquet
+
+    monkeypatch.setattr(merp2tbl, "ARROW_BATCH_ROWS", 5)
+    results = _long_merp_rows(24)
+    results[1]["value_f"] = "NA"
+    for i, result in enumerate(results):
+        result["subject_s"] = "NA" if i == 3 else "s{0:03d}".format(i % 7)
+    output = merp2tbl.format_output(
+        results,
+        "typical_good.mcf",
+        fmt=fmt,
+        tag_file="test_typical_good.yml",
+        validate="off",
+    )
+    read = dict(parquet=pa.parquet.read_table, feather=pa.feather.read_table)[fmt]
+    table = read(pa.BufferReader(output))
+    assert table.schema.field("value").type == pa.float64()
+    assert table.schema.field("bin").type == pa.int64()
+    assert table.schema.field("subject").type == pa.dictionary(pa.int32(), pa.string())
+    subjects = table.column("subject").to_pylist()
+    assert subjects[:5] == ["s000", "s001", "s002", None, "s004"]
+    assert subjects[7] == "s000"
+    assert (
+        table.to_pydict()
+        == merp2tbl.to_arrow(results, tag_file="test_typical_good.yml").to_pydict()
+    )
+    assert table.column("value")[1].as_py() is None
+    assert table.column("long_row_tag").to_pylist()[-1] == "tagX"
+
+
+def test_iter_rows_types():
+    """schema from the key suffixes, NA passes through"""
+    results = _long_merp_rows(3)
+    results[1]["value_f"] = "NA"
+    rows = list(merp2tbl.iter_rows(results))
+    assert [r["value"] for r in rows] == [600.0, "NA", 608.0]
+    assert rows[0]["chan"] == 17 and type(rows[0]["chan"]) is int
+    assert rows[0]["win_start"] == 250.0 and type(rows[0]["win_start"]) is float
+    assert rows[0]["merp_error"] == "NA"
+    assert list(rows[0].keys()) == [k[:-2] for k in results[0].keys()]
+
+    # every row must have the same columns
+    del results[2]["units_s"]
+    with pytest.raises(AssertionError):
+        list(merp2tbl.iter_rows(results))
+
+
+def test_lint_tags_cache(tmp_path, monkeypatch):
+    """tag files are linted once, then skipped by digest"""
+    linted = []
+    run = yamllint.linter.run
+
+    def counting_run(tag_stream, config):
+        linted.append(tag_stream)
+        return run(tag_stream, config)
+
+    monkeypatch.setattr(yamllint.linter, "run", counting_run)
+    monkeypatch.setattr(merp2tbl, "_LINTED_TAGS", set())
+    for _ in range(2):
+        tags = merp2tbl.load_tagfile("test_typical_good.yml")
+    assert len(linted) == 1
+
+    # nothing on disk without a cache directory
+    monkeypatch.setattr(merp2tbl, "_LINTED_TAGS", set())
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "home"))
+    assert merp2tbl.load_tagfile("test_typical_good.yml") == tags
+    assert len(linted) == 2 and not (tmp_path / "home").exists()
+
+    # next process, on-disk marker
+    for _ in range(2):
+        monkeypatch.setattr(merp2tbl, "_LINTED_TAGS", set())
+        assert (
+            merp2tbl.load_tagfile("test_typical_good.yml", cache=str(tmp_path)) == tags
+        )
+    assert len(linted) == 3 and len(os.listdir(tmp_path / "lint")) == 1
+
+    # bad YAML is never cached
+    with pytest.raises(Exception):
+        merp2tbl.lint_tags("a: [b,\n", cache=str(tmp_path))
+    with pytest.raises(Exception):
+        merp2tbl.lint_tags("a: [b,\n", cache=str(tmp_path))
+    assert len(linted) == 5
+
+    assert merp2tbl.load_tagfile("test_typical_good.yml", lint=False) == tags
+    assert len(linted) == 5
+
+
+def test_iter_rows_preloaded_tags():
+    """tags loaded once can be passed in place of the tag file"""
+    results = _long_merp_rows(24)
+    tags = merp2tbl.load_tagfile("test_typical_good.yml")
+    rows = list(merp2tbl.iter_rows(results, tag_file=tags))
+    assert rows == list(merp2tbl.iter_rows(results, tag_file="test_typical_good.yml"))
+    assert [r["long_row_tag"] for r in rows] == tags["long_row_tag"]
+    assert all(r["task_tag"] == "pict mem" for r in rows)
+    assert list(rows[0].keys())[-len(tags) :] == list(tags.keys())
+
+
+def test_expand_merpfiles():
+    """glob patterns expand sorted, plain names pass through"""
+    assert merp2tbl.expand_merpfiles("typical_good.mcf") == ["typical_good.mcf"]
+    assert merp2tbl.expand_merpfiles(["no_such.mcf", "typical*good.mcf"]) == [
+        "no_such.mcf",
+        "typical_baseline_good.mcf",
+        "typical_good.mcf",
+    ]
+    with pytest.raises(ValueError):
+        merp2tbl.expand_merpfiles("no_such*.mcf")
+
+
+@skip_ci
+def test_run_merp_files(tmp_path):
+    """many command files in one run match one run per file"""
+    expected = []
+    for mcf in sorted(good_mcfs):
+        expected += merp2tbl.run_merp(mcf)
+    assert merp2tbl.run_merp_files("*good.mcf") == expected
+    cache = str(tmp_path / "cache")
+    assert merp2tbl.run_merp_files(sorted(good_mcfs), jobs=4, cache=cache) == expected
+    assert merp2tbl.run_merp_files("*good.mcf", batch=True, cache=cache) == expected
+
+
+def test_write_output_many_files(monkeypatch):
+    """each command file is validated against its own rows"""
+    results = _long_merp_rows(24)
+    for r in results[20:]:
+        r["merpfile_s"] = "minimal_good.mcf"
+
+    checked = []
+
+    def _validate_values(values, mcf, mode, merp_cmds):
+        checked.append((mcf, values))
+        return (0, "")
+
+    monkeypatch.setattr(merp2tbl, "_validate_values", _validate_values)
+    mcfs = ["typical_good.mcf", "minimal_good.mcf"]
+    merp2tbl.write_output(results, mcfs, io.StringIO())
+    assert [(mcf, len(values)) for mcf, values in checked] == [
+        ("typical_good.mcf", 20),
+        ("minimal_good.mcf", 4),
+    ]
+
+    # one command file gets all the rows
+    checked.clear()
+    merp2tbl.write_output(results, "typical_good.mcf", io.StringIO())
+    assert [(mcf, len(values)) for mcf, values in checked] == [("typical_good.mcf", 24)]
+
+
+def test_import_time():
+    """plain TSV runs don't import the YAML, cache or columnar machinery"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import merp2tbl.merp2tbl"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    imported = [
+        line.split("|")[-1].strip()
+        for line in proc.stderr.decode("utf-8").splitlines()
+        if line.startswith("import time:")
+    ]
+    assert "merp2tbl.merp2tbl" in imported
+    for module in ["yaml", "yamllint", "sqlite3", "concurrent.futures", "pyarrow"]:
+        assert module not in imported
+
+    # still there when asked for
+    assert merp2tbl.TAGF_LINT_CONFIG is merp2tbl.TAGF_LINT_CONFIG
+    with pytest.raises(AttributeError):
+        merp2tbl.NO_SUCH_THING
+
+
+def test_run_manifest(tmp_path, monkeypatch):
+    """incremental runs only measure commands that changed"""
+    measured = []
+
+    def _measure(merp_cmds, mcf):
+        measured.append(merp_cmds)
+        erpfile = merp_cmds[0].split(" ", 1)[1]
+        with open(erpfile, "rb") as f:
+            value = "{0} {1}".format(len(f.read()), merp_cmds[2].split()[-1])
+        measurement = {"erpfile_s": erpfile, "value_f": value}
+        return merp2tbl._log_measurement(measurement, merp_cmds, mcf)
+
+    monkeypatch.setattr(merp2tbl, "_measure", _measure)
+    monkeypatch.chdir(tmp_path)
+    for erpfile in ["a.nrm", "b.nrm"]:
+        with open(erpfile, "wb") as f:
+            f.write(b"\0" * 8)
+    mcf_text = (
+        "file a.nrm\nmeana 1 1 a.nrm 200 400\nfile b.nrm\nmeana 1 1 b.nrm 200 400\n"
+    )
+    with open("run.mcf", "w") as f:
+        f.write(mcf_text)
+
+    def incremental():
+        measured.clear()
+        manifest = merp2tbl.RunManifest("manifest.json")
+        results = merp2tbl.run_merp("run.mcf", cache=manifest)
+        manifest.close()
+        return [r["value_f"] for r in results], len(measured)
+
+    assert incremental() == (["8 400", "8 400"], 2)
+    assert incremental() == (["8 400", "8 400"], 0)
+
+    # changed ERP file
+    with open("b.nrm", "ab") as f:
+        f.write(b"\0")
+    assert incremental() == (["8 400", "9 400"], 1)
+
+    # changed measure, whitespace doesn't count
+    with open("run.mcf", "w") as f:
+        f.write(mcf_text.replace("1 1 a.nrm 200 400", "1 1 a.nrm  200 4000"))
+    assert incremental() == (["8 4000", "9 400"], 1)
+    with open("run.mcf", "w") as f:
+        f.write(mcf_text.replace("1 1 a.nrm 200 400", "1 1  a.nrm 200 4000"))
+    assert incremental() == (["8 4000", "9 400"], 0)
+
+    # manifest only keeps the latest run
+    with open("manifest.json") as f:
+        assert len(json.load(f)["rows"]) == 2
+
+
+def test_merp_record():
+    """records read and write like the dicts they replace"""
+    row = merp2tbl.LONG_MERP_PARSER.parse(LONG_MERP_OUT, b"")
+    assert isinstance(row, merp2tbl.MerpRecord)
+    assert row == LONG_MERP_ROW and dict(row) == LONG_MERP_ROW
+    assert row.get("no_such_key") is None and "value_f" in row
+
+    # new and deleted keys share the schema of other records with those keys
+    other = row.copy()
+    row["merpfile_s"] = "typical_good.mcf"
+    other.update({"merpfile_s": "minimal_good.mcf"})
+    assert list(row.keys())[-1] == "merpfile_s"
+    assert row._fields is other._fields
+    del row["merpfile_s"]
+    assert row == LONG_MERP_ROW
+    with pytest.raises(KeyError):
+        row["merpfile_s"]
+    with pytest.raises(ValueError):
+        merp2tbl.MerpRecord(["a", "b"], [1])
+
+
+def test_merp_record_memory():
+    """a million measurements shouldn't be mostly dict overhead"""
+    import tracemalloc
+
+    rows = merp2tbl.LONG_MERP_PARSER.parse_many([(LONG_MERP_OUT, b"")] * 2000)
+
+    # same value strings either way, count the containers
+    def allocated(container):
+        tracemalloc.start()
+        copies = [container(row) for row in rows]
+        nbytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert copies == rows
+        return nbytes
+
+    assert allocated(merp2tbl.MerpRecord.copy) < 0.6 * allocated(dict)
+
+
+def test_yaml_anchors():
+    """anchored YAML is smaller and loads the same"""
+    results = _long_merp_rows(24)
+    plain = merp2tbl.format_output(
+        results, "typical_good.mcf", fmt="yaml", validate="off"
+    )
+    anchored = merp2tbl.format_output(
+        results, "typical_good.mcf", fmt="yaml", validate="off", anchors=True
+    )
+    assert anchored.startswith("# generated by merp2tbl\n---\n")
+    assert "subject: &id" in anchored and "subject: *id" in anchored
+    assert len(anchored) < len(plain)
+    assert yaml.safe_load(anchored) == yaml.safe_load(plain)
+
+    stream = io.StringIO()
+    merp2tbl.write_output(
+        results, "typical_good.mcf", stream, fmt="yaml", validate="off", anchors=True
+    )
+    assert stream.getvalue() == anchored + "\n"
+    empty = merp2tbl.format_output(
+        [], "typical_good.mcf", fmt="yaml", validate="off", anchors=True
+    )
+    assert empty == ""
+
+
+def test_profiler(tmp_path, monkeypatch):
+    """stages are timed and counted only while profiling"""
+    monkeypatch.setattr(merp2tbl, "_MD5_CACHE", dict())
+    results = _long_merp_rows(24)
+    with merp2tbl.Profiler() as prof:
+        merp2tbl.parse_long_merp_output(LONG_MERP_OUT, b"")
+        merp2tbl.erp_md5("calstest.x.avg")
+        output = merp2tbl.format_output(
+            results,
+            "typical_good.mcf",
+            tag_file="test_typical_good.yml",
+            validate="off",
+        )
+    merp2tbl.parse_long_merp_output(LONG_MERP_OUT, b"")  # not counted
+
+    report = prof.report()
+    stages = report["stages"]
+    assert stages["parse"]["calls"] == 1
+    assert stages["parse"]["bytes"] == len(LONG_MERP_OUT)
+    assert stages["md5"]["bytes"] == os.path.getsize("calstest.x.avg")
+    assert stages["convert"]["calls"] == stages["tags"]["calls"] == 24
+    assert stages["format"]["bytes"] == len(output) - len(output.split("\n")[0]) - 1
+    assert report["wall_s"] >= stages["format"]["wall_s"] > 0
+    assert merp2tbl._PROFILER is None
+
+    header = prof.summary().splitlines()[0].split()
+    assert header == ["stage", "calls", "wall_s", "cpu_s", "bytes"]
+    prof.write_json(str(tmp_path / "profile.json"))
+    with open(str(tmp_path / "profile.json")) as f:
+        assert json.load(f) == report
+
+
+def test_erp_file():
+    """ERPSS header fields and samples"""
+    erp = merp2tbl.ErpFile("calstest.x.nrm")
+    assert erp.data.shape == (17, 32, 256)
+    assert erp.chan_descs[:3] == ["lle", "lhz", "MiPf"]
+    assert erp.chan_descs[17] == "LDCe"
+    assert erp.bin_info(1) == [
+        "9",
+        "calstest template",
+        "bin 1 cc/cal 1 item 1",
+        "experimental items",
+        "event coded cal pulses",
+    ]
+    assert (erp.period_ms, erp.presampling_ms) == (4.0, 100.0)
+    assert erp.index(0) == 25 and erp.index(254) == 88
+    assert erp.latency(88) == 252.0
+
+    with pytest.raises(ValueError):
+        merp2tbl.ErpFile("typical_good.mcf")
+
+
+def test_open_erp(tmp_path, monkeypatch):
+    """one zero-copy mapping per ERP file version"""
+    opened = []
+
+    class CountingErpFile(merp2tbl.ErpFile):
+        def __init__(self, path, md5=None):
+            opened.append(path)
+            super().__init__(path, md5)
+
+    monkeypatch.setattr(merp2tbl, "ErpFile", CountingErpFile)
+    merp2tbl._open_erp.cache_clear()
+    for merp_cmds in merp2tbl.parse_merpfile("typical_good.mcf"):
+        assert merp2tbl.measure_native(merp_cmds) is not None
+    assert sorted(os.path.basename(path) for path in opened) == [
+        "calstest.x.avg",
+        "calstest.x.nrm",
+    ]
+
+    erpfile = tmp_path / "copy.avg"
+    erpfile.write_bytes(Path("calstest.x.avg").read_bytes())
+    erp = merp2tbl.open_erp(str(erpfile))
+    assert merp2tbl.open_erp(str(erpfile)) is erp
+    waveform = erp.data[1, 17]
+    assert not (erp.data.flags.owndata or erp.data.flags.writeable)
+    assert np.shares_memory(waveform, erp.data)
+
+    # rewritten file, new digest, new mapping
+    mtime_ns = erpfile.stat().st_mtime_ns
+    erpfile.write_bytes(Path("calstest.x.nrm").read_bytes())
+    os.utime(erpfile, ns=(mtime_ns + 10**9, mtime_ns + 10**9))
+    assert merp2tbl.open_erp(str(erpfile)) is not erp
+    merp2tbl._open_erp.cache_clear()
+
+
+def test_waveform_cache(monkeypatch):
+    """measures on the same file, bin and baseline share one corrected array"""
+    erp = merp2tbl.open_erp("calstest.x.avg")
+    nbytes = erp.data[1].size * 8
+    cache = merp2tbl.WaveformCache(max_bytes=2 * nbytes)
+
+    waveforms = cache.get(erp, 1, "default")
+    assert not waveforms.flags.writeable
+    expected = (
+        erp.data[1] - np.trunc(erp.data[1, :, : erp.index(0)].mean(axis=1))[:, None]
+    )
+    assert (waveforms == expected).all()
+    assert (
+        cache.get(erp, 1, "baseline -{0:.0f} 0".format(erp.presampling_ms)) is waveforms
+    )
+    assert (cache.get(erp, 1, "nobaseline") == erp.data[1]).all()
+    assert (cache.hits, cache.misses, cache.nbytes) == (1, 2, 2 * nbytes)
+
+    # least recently used goes first
+    cache.get(erp, 2, "default")
+    assert cache.nbytes == 2 * nbytes
+    assert cache.get(erp, 1, "default") is not waveforms
+    with pytest.raises(ValueError):
+        cache.get(erp, 1, "baseline -2000 0")
+
+    # each bin and baseline of a command file is corrected once
+    cache = merp2tbl.WaveformCache()
+    monkeypatch.setattr(merp2tbl, "WAVEFORM_CACHE", cache)
+    for merp_cmds in merp2tbl.parse_merpfile("typical_good.mcf"):
+        merp2tbl.measure_native(merp_cmds)
+    assert (cache.hits, cache.misses) == (3 * 4 * 2 - 2, 2)
+
+
+def test_measure_native():
+    """native measurements are the same rows as merp's"""
+    for mcf in good_mcfs + softerror_mcfs:
+        expected = pd.read_csv(
+            mcf.replace("mcf", "tsv"),
+            sep="\t",
+            index_col=0,
+            dtype=str,
+            keep_default_na=False,
+        ).to_dict(orient="records")
+        merp_cmds_list = merp2tbl.parse_merpfile(mcf)
+        assert len(merp_cmds_list) == len(expected)
+        for merp_cmds, row in zip(merp_cmds_list, expected):
+            measurement = merp2tbl.measure_native(merp_cmds)
+            assert dict(merp2tbl._log_measurement(measurement, merp_cmds, mcf)) == row
+
+    # left to merp
+    for merp_cmds in [
+        ("file calstest.x.nrm", "default", "pnppa 1 17 calstest.x.nrm 200 400"),
+        ("file calstest.x.nrm", "baseline -200 0", "meana 1 17 calstest.x.nrm 200 400"),
+        ("file calstest.x.nrm", "default", "meana 17 17 calstest.x.nrm 200 400"),
+        ("file calstest.x.nrm", "default", "meana 1 17 calstest.x.nrm 200 1200"),
+        ("file no_such.nrm", "default", "meana 1 17 no_such.nrm 200 400"),
+        ("file typical_good.mcf", "default", "meana 1 17 typical_good.mcf 200 400"),
+    ]:
+        assert merp2tbl.measure_native(merp_cmds) is None
+
+
+def test_measure_native_measures():
+    """the uncalibrated measures agree with the samples, opt in only"""
+    erp = merp2tbl.ErpFile("calstest.x.avg")
+    x = erp.data[1, 17].astype(float) - int(erp.data[1, 17, :25].mean())
+    lo, hi = erp.index(250), erp.index(800)
+
+    def value(meas, args=""):
+        cmd = "{0} 1 17 calstest.x.avg 250 800 {1}".format(meas, args).strip()
+        merp_cmds = ("file calstest.x.avg", "default", cmd)
+        if meas not in merp2tbl.NATIVE_CALIBRATED:
+            assert merp2tbl.measure_native(merp_cmds) is None
+        row = merp2tbl.measure_native(merp_cmds, merp2tbl.NATIVE_MEASURES)
+        assert row["merp_error_s"] == "NA"
+        return float(row["value_f"])
+
+    assert value("pka", "+") == round(x[lo : hi + 1].max() / 100, 2)
+    assert value("pka", "-") == round(x[lo : hi + 1].min() / 100, 2)
+    assert x[erp.index(value("pkl", "-"))] == x[lo : hi + 1].min()
+    assert value("rms") == round((x[lo : hi + 1] ** 2).mean() ** 0.5 / 100, 2)
+    assert 250 < value("centroid", "+") < 800
+    faa = x[erp.index(value("fal", "+ .5"))] / 100
+    assert value("faa", "+ .5") == pytest.approx(faa, abs=0.005)
+    assert abs(value("slope")) < 0.01
+
+
+def test_measure_native_many():
+    """channels measured at once land in command order with the one at a time values"""
+    merp_cmds_list = [
+        (
+            "file calstest.x.avg",
+            baseline,
+            "{0} 1 {1} calstest.x.avg 200 600{2}".format(meas, chan, args),
+        )
+        for baseline in ("default", "nobaseline")
+        for meas, args in [
+            ("meana", ""),
+            ("lpkl", " + 3"),
+            ("fal", " - .5"),
+            ("pnppa", ""),
+        ]
+        for chan in (17, 3, "x", 0, 99, 26)
+    ]
+    random.Random(0).shuffle(merp_cmds_list)
+    expected = [merp2tbl.measure_native(merp_cmds) for merp_cmds in merp_cmds_list]
+    assert merp2tbl.measure_native_many(merp_cmds_list) == expected
+    assert sum(measurement is None for measurement in expected) == 24
+
+    # a measure line is one unit
+    merp_cmds_list = merp2tbl.parse_merpfile("typical_good.mcf")
+    units = list(merp2tbl._group_expansions(enumerate(merp_cmds_list)))
+    assert [idx for idxs, _ in units for idx in idxs] == list(
+        range(len(merp_cmds_list))
+    )
+    assert len(units) == 4
+    for idxs, merp_cmds_group in units:
+        assert merp_cmds_group == [merp_cmds_list[idx] for idx in idxs]
+
+
+def test_native_units(tmp_path):
+    """unbatched native runs leave merp a command per unit, like engine merp"""
+    mcf = tmp_path / "fallback.mcf"
+    mcf.write_text(
+        "file {0}\nchannels 17 21 22\n"
+        "meana 1 $ * 200 400\nmeana 1 $ * 200 1200\n".format(
+            os.path.abspath("calstest.x.avg")
+        )
+    )
+    merp_cmds_list = merp2tbl.parse_merpfile(str(mcf))
+    units = list(merp2tbl._iter_native_units(enumerate(merp_cmds_list), str(mcf)))
+    assert [idxs for idxs, _ in units] == [[0, 1, 2], [3], [4], [5]]
+    assert isinstance(units[0][1], merp2tbl._Measured)
+    assert [unit for _, unit in units[1:]] == [
+        [merp_cmds] for merp_cmds in merp_cmds_list[3:]
+    ]
+
+
+def test_run_merp_dedup(tmp_path, monkeypatch, capsys):
+    """repeated measures are measured once and copied to each row"""
+    mcf = tmp_path / "repeats.mcf"
+    erpfile = os.path.abspath("calstest.x.avg")
+    mcf.write_text(
+        "file {0}\nfile {0}\nchannels 17 21\n"
+        "meana 1 17 {0} 200 400\nmeana 1 $ * 200 400\n".format(erpfile)
+    )
+    measured = []
+    measure_native_many = merp2tbl._measure_native_many
+
+    def spy(merp_cmds_group, *args):
+        measured.extend(merp_cmds_group)
+        return measure_native_many(merp_cmds_group, *args)
+
+    monkeypatch.setattr(merp2tbl, "_measure_native_many", spy)
+    merp_cmds_list = merp2tbl.parse_merpfile(str(mcf))
+    for batch in (False, True):
+        measured.clear()
+        measurements = merp2tbl.run_merp(
+            str(mcf), debug=True, batch=batch, engine="native"
+        )
+        assert sorted(measured) == sorted(set(merp_cmds_list))
+        assert len(measured) == 2
+        assert [m["chan_d"] for m in measurements] == ["17"] * 3 + ["21"] * 2
+        assert (
+            measurements[0] == measurements[1]
+            and measurements[0] is not measurements[1]
+        )
+        captured = capsys.readouterr()
+        assert "measures 5 unique 2 dedup ratio 2.50" in captured.err
+        assert captured.out == ""  # -debug reports stay off the table
+
+    # repeats of commands older than the window are measured again
+    mcf.write_text(
+        "file {0}\nmeana 1 17 {0} 200 400\nmeana 1 21 {0} 200 400\n"
+        "meana 1 17 {0} 200 400\n".format(erpfile)
+    )
+    measured.clear()
+    measurements = merp2tbl.run_merp(str(mcf), engine="native")
+    assert len(measured) == 2
+    monkeypatch.setattr(merp2tbl, "DEDUP_WINDOW", 1)
+    measured.clear()
+    assert merp2tbl.run_merp(str(mcf), engine="native") == measurements
+    assert len(measured) == 3
+
+
+def test_repeats_window():
+    """dedup state stays within the window however long the run"""
+    merp_cmds_list = [
+        ("file a.avg", "default", "meana 1 {0} a.avg 200 400".format(i % 6))
+        for i in range(60)
+    ]
+    repeats = merp2tbl._Repeats(4)
+    for idx, merp_cmds in repeats.iter_unique(enumerate(merp_cmds_list)):
+        repeats.keep(idx, {"idx": idx})
+    assert repeats.n_repeats == 0  # each repeat is 6 back, outside the window
+    assert len(repeats._recent) == len(repeats._kept) == 4
+
+    # in the window, measured once and handed off in order
+    repeats = merp2tbl._Repeats(8)
+    rows = []
+    for idx, merp_cmds in repeats.iter_unique(enumerate(merp_cmds_list)):
+        rows.append({"idx": idx})
+        repeats.keep(idx, rows[-1])
+    rows += [repeats.take(idx) for idx in range(len(rows), len(merp_cmds_list))]
+    assert [row["idx"] for row in rows] == [i % 6 for i in range(60)]
+    assert not (repeats.dups or repeats._pinned or repeats._last_use)
+
+
+@skip_stub_merp
+def test_run_merp_native():
+    """the native engine passes the merp -d cross check"""
+    for mcf in good_mcfs + softerror_mcfs:
+        measurements = merp2tbl.run_merp(mcf, engine="native")
+        assert measurements == merp2tbl.run_merp(mcf)
+        output = merp2tbl.format_output(measurements, mcf, validate="off")
+        assert merp2tbl.validate_output(output, "tsv", mcf) == (0, "")
+
+
+def test_run_merp_native_all(tmp_path, monkeypatch):
+    """the unchecked measures are computed only with native-all"""
+    mcf = tmp_path / "rms.mcf"
+    mcf.write_text(
+        "file {0}\nrms 1 17 {0} 200 400\n".format(os.path.abspath("calstest.x.avg"))
+    )
+    monkeypatch.setattr(merp2tbl, "_measure", lambda merp_cmds, mcf: {"by": "merp"})
+    assert merp2tbl.run_merp(str(mcf), engine="native") == [{"by": "merp"}]
+    (row,) = merp2tbl.run_merp(str(mcf), engine="native-all")
+    assert row["meas_label_s"] == "rms" and row["merp_error_s"] == "NA"
+    assert type(row) is dict
+    (merp_cmds,) = merp2tbl.parse_merpfile(str(mcf))
+    assert type(merp2tbl.measure_native(merp_cmds, merp2tbl.NATIVE_MEASURES)) is dict
+
+
+def test_run_merp_bad_engine():
+    with pytest.raises(ValueError):
+        merp2tbl.run_merp(good_mcfs[0], engine="fast")